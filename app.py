@@ -1,12 +1,19 @@
 import dash
 from dash import dcc
 from dash import html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import dash_bootstrap_components as dbc
 import dash_table
+import functools
+import glob
+import os
 
+from python.data import get_calendar_day
 from python.model import Model
 from python.plot import Plot
+from python.cache import CallbackCache
+from python.metrics import install, stage, timed_callback
 
 
 ##############################
@@ -21,6 +28,9 @@ app = dash.Dash(name='name', external_stylesheets=[theme, css])
 server = app.server
 app.title = 'HADCET Temperature Data'
 
+# Server-Timing headers, /metrics, and per-request profiling (see python/metrics.py)
+install(server)
+
 
 ###################################################################################
 ### Setup - get data, create initial objects that will get updated in callbacks ###
@@ -35,9 +45,18 @@ month_dict = {short_months[i]: i + 1 for i in range(12)}
 month_dict_rev = {v: k for k, v in month_dict.items()}
 month_length_dict = {1: 31, 2: 29, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
 
-# instantiate our two classes
-hadcet = Model(local_data=False)
-plot = Plot(hadcet.df, hadcet.ave_df)
+# instantiate our two classes (set HADCET_DATA_DIR, ex. to the bundled data/ folder, to skip the download)
+data_dir = os.environ.get('HADCET_DATA_DIR')
+hadcet = Model(local_data=True, data_dir=data_dir) if data_dir else Model(local_data=False)
+plot = Plot(hadcet.df, hadcet.ave_df, hadcet.day_hist, hadcet.year_matrix, hadcet.main_series)
+
+# callback results are shared by all workers through HADCET_CACHE_DIR (defaults to a private folder in the temp dir).
+#  a fresh download with different data, or a deploy that changes this file or anything in python/, gets a new
+#  version, and versions no worker has written to in a day are cleared
+app_dir = os.path.dirname(os.path.abspath(__file__))
+code_files = [os.path.join(app_dir, 'app.py')] + glob.glob(os.path.join(app_dir, 'python', '*.py'))
+cache = CallbackCache(hadcet.version, os.environ.get('HADCET_CACHE_DIR'), code_files=code_files)
+cache.invalidate(hadcet.version)
 
 # initial values we'll use for the start of the dashboard
 day0, month0, year0 = 1, 1, 2020
@@ -54,6 +73,8 @@ start_day_perc_geq = hadcet.get_perc_geq(month0, day0, temp0)
 start_recs_min, start_recs_max = hadcet.get_day_records(month0, day0)
 start_year_comp_table = hadcet.get_year_comp_table([2020])
 start_year_comp_graph = plot.get_year_comparison_graph([2020], 1)
+start_timeline = plot.get_timeline()
+start_heatmap = plot.get_heatmap()
 
 
 #####################
@@ -106,7 +127,9 @@ layout_part1 = html.Div([
             html.Br()],
             width={'offset': 0, 'size': 2},
             style={'border': '4px #073763 solid', 'border-radius': '4px', 'height': '280px', 'align': 'bottom'}),
-        dbc.Col(children=[dcc.Graph(id='plot', figure=start_lineplot)],
+        dbc.Col(children=[dcc.Graph(id='plot', figure=start_lineplot),
+                          # holds only the changed year trace, the clientside callback below patches it into 'plot'
+                          dcc.Store(id='plot-patch')],
                 width={'size': 10})]),
     html.Br(), html.Br(),
     html.Hr()])
@@ -134,7 +157,11 @@ layout_part2_row1 = html.Div([
             html.Br(), html.Br()],
             width={'offset': 0, 'size': 2}, align='center',
             style={'border': '4px #073763 solid', 'border-radius': '4px', 'height': '290px'}),
-        dbc.Col(dcc.Graph(id='day-hist', figure=start_day_hist), align='bottom'),
+        dbc.Col(children=[dcc.Graph(id='day-hist', figure=start_day_hist),
+                          # new bar heights (date changes) and vline position (temp changes), patched in clientside
+                          dcc.Store(id='day-hist-patch'),
+                          dcc.Store(id='day-hist-temp')],
+                align='bottom'),
         dbc.Col(children=[
             html.Div(id='day-perc-geq',
                      children=[html.P(f'← \n'),  # , style={'font-size': '24px', 'align': 'center'}),
@@ -204,8 +231,10 @@ layout_part3 = html.Div([
             html.Br()],
             width={'offset': 0, 'size': 2}, align='center',
             style={'border': '4px #073763 solid', 'border-radius': '4px', 'height': '290px'}),
-        dbc.Col(
+        dbc.Col(children=[
             dcc.Graph(id='year-comparison-graph', figure=start_year_comp_graph),
+            # holds the added/kept/removed year traces, the clientside callback below patches them into the graph
+            dcc.Store(id='year-comparison-patch')],
             width={'offset': 0, 'size': 7}, align='center'),
         dbc.Col(
             dash_table.DataTable(id='year-comparison-table',
@@ -231,8 +260,44 @@ layout_part3 = html.Div([
 
 
 
-# PART 4 - "ABOUT" SECTION
+# PART 4 - EVERY DAILY TEMPERATURE ON RECORD
 layout_part4 = html.Div([
+    dbc.Row([
+        dbc.Col([
+            html.Div('Explore the Full Daily Record',
+                     style={'font-weight': 'bold', 'font-size': '32px'})])]),
+    html.Div('Zoom in on any stretch of time to see more detail', style={'font-size': '16px'}),
+    html.Br(),
+    dbc.Row([
+        dbc.Col(children=[dcc.Graph(id='timeline', figure=start_timeline),
+                          # holds the downsampled points for the current zoom, patched into 'timeline' clientside
+                          dcc.Store(id='timeline-patch')])]),
+    html.Br(), html.Br(),
+    html.Hr()])
+
+
+
+# PART 5 - EVERY DAY ON RECORD AS A HEATMAP OF ANOMALIES
+layout_part5 = html.Div([
+    dbc.Row([
+        dbc.Col([
+            html.Div('How Unusual Was Every Day?',
+                     style={'font-weight': 'bold', 'font-size': '32px'})])]),
+    html.Div('Each row is a year, each column a day of the year, colored by how much warmer (red) or colder (blue) '
+             'than average that day was. The whole record is shown a week per column, zoom in to see every day',
+             style={'font-size': '16px'}),
+    html.Br(),
+    dbc.Row([
+        dbc.Col(children=[dcc.Graph(id='heatmap', figure=start_heatmap),
+                          # holds the packed cells for the current zoom, unpacked into 'heatmap' clientside
+                          dcc.Store(id='heatmap-patch')])]),
+    html.Br(), html.Br(),
+    html.Hr()])
+
+
+
+# PART 6 - "ABOUT" SECTION
+layout_part6 = html.Div([
     html.Div('Links', style={'font-weight': 'bold', 'font-size': '24px', 'margin-left': '10px'}),
     html.Div("The HadCET data is hosted by the United Kingdom's Meteorological Office "
              "and can be found here:", style={'margin-left': '20px'}),
@@ -275,13 +340,35 @@ layout_part4 = html.Div([
 
 
 # PART 1 CALLBACK - UPDATE SMOOTHED LINEPLOT OF ONE YEAR'S TEMPERATURES
+#  only the selected year's trace goes over the wire, the five all-time traces and the layout never change
 @app.callback(
-    output=Output(component_id='plot', component_property='figure'),
+    output=Output(component_id='plot-patch', component_property='data'),
     inputs=[
         Input(component_id='year-input', component_property='value'),
         Input(component_id='window-size-input', component_property='value')])
+@timed_callback
 def update_part1(year, window_size):
-    return plot.get_lineplot(year, window_size)
+    with stage('plot'):
+        lineplot_patch = plot.get_lineplot_patch(year, window_size)
+    return lineplot_patch
+
+
+# the year trace is always the last of the six traces in the plot, so just swap it out (reusing the all-time x values)
+app.clientside_callback(
+    """
+    function(patch, figure) {
+        if (!patch || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var data = figure.data.slice(0, 5);
+        data.push(Object.assign({}, patch.trace, {x: figure.data[0].x}));
+        var layout = Object.assign({}, figure.layout, {datarevision: patch.year + '-' + patch.window_size});
+        return Object.assign({}, figure, {data: data, layout: layout});
+    }
+    """,
+    Output(component_id='plot', component_property='figure'),
+    Input(component_id='plot-patch', component_property='data'),
+    State(component_id='plot', component_property='figure'))
 
 
 
@@ -314,35 +401,103 @@ def update_available_days(month, day):
 
 
 
-# PART 2 CALLBACK 2 - UPDATE SINGLE DATE IN HISTORY, TEMP
+# the day input's max only catches up with the month one round trip later, so a date like feb 31 can still reach the
+#  callbacks below. nothing is updated (or cached) for a date that doesn't exist
+def valid_date(func):
+    @functools.wraps(func)
+    def wrapper(month, day, *args):
+        try:
+            get_calendar_day(month_dict[month], day)
+        except (KeyError, TypeError, ValueError):
+            raise PreventUpdate
+        return func(month, day, *args)
+    return wrapper
+
+
+
+# PART 2 CALLBACK 2 - UPDATE SINGLE DATE IN HISTORY
+#  the histogram is binned ahead of time, so only the new bar heights and title get sent
 @app.callback(
     output=[
-        Output(component_id='day-hist', component_property='figure'),
+        Output(component_id='day-hist-patch', component_property='data'),
         Output(component_id='day-recent-title', component_property='children'),
         Output(component_id='day-last-5yr', component_property='data'),
-        Output(component_id='day-perc-geq', component_property='children'),
         Output(component_id='day-record-title-min', component_property='children'),
         Output(component_id='day-record-title-max', component_property='children'),
         Output(component_id='day-records-min', component_property='data'),
         Output(component_id='day-records-max', component_property='data')],
+    inputs=[
+        Input(component_id='month-input', component_property='value'),
+        Input(component_id='day-input', component_property='value')])
+@timed_callback
+@valid_date
+@cache.memoize(key=lambda month, day: (month_dict[month], int(day)))
+def update_part2(month, day):
+    with stage('plot'):
+        day_hist_patch = plot.get_day_hist_patch(month_dict[month], day)
+    day_recent_title = f'Recent temps on {long_months[short_months.index(month)]} {day}:'
+    with stage('model'):
+        day_recent_5yr = hadcet.get_day_prev_5yr(short_months.index(month) + 1, day)
+    day_records_title_min = f'Record lows on {long_months[short_months.index(month)]} {day}:'
+    day_records_title_max = f'Record highs on {long_months[short_months.index(month)]} {day}:'
+    with stage('model'):
+        day_records_min, day_records_max = hadcet.get_day_records(short_months.index(month) + 1, day)
+    with stage('table'):
+        day_recent_5yr, day_records_min, day_records_max = \
+            [table.to_dict('records') for table in [day_recent_5yr, day_records_min, day_records_max]]
+    return day_hist_patch, day_recent_title, day_recent_5yr, \
+           day_records_title_min, day_records_title_max, \
+           day_records_min, day_records_max
+
+
+
+# PART 2 CALLBACK 3 - UPDATE TEMP (PROBABILITY STATEMENT AND HISTOGRAM VLINE)
+#  changing only the temp never touches the histogram's bars, just the vline and the text
+@app.callback(
+    output=[
+        Output(component_id='day-hist-temp', component_property='data'),
+        Output(component_id='day-perc-geq', component_property='children')],
     inputs=[
         Input(component_id='month-input', component_property='value'),
         Input(component_id='day-input', component_property='value'),
         Input(component_id='temp-input', component_property='value')])
-def update_part2(month, day, temp):
-    day_hist = plot.get_day_hist(month_dict[month], day, temp)
-    day_recent_title = f'Recent temps on {long_months[short_months.index(month)]} {day}:'
-    day_recent_5yr = hadcet.get_day_prev_5yr(short_months.index(month) + 1, day)
+@timed_callback
+@valid_date
+@cache.memoize(key=lambda month, day, temp: (month_dict[month], int(day), float(temp)))
+def update_part2_temp(month, day, temp):
+    with stage('model'):
+        perc_geq = hadcet.get_perc_geq(short_months.index(month) + 1, day, temp)
     day_perc_geq = [html.P(f'← \n'),
-                    html.P(f'{hadcet.get_perc_geq(short_months.index(month) + 1, day, temp)}% of days on '
+                    html.P(f'{perc_geq}% of days on '
                            f'record with the date of {long_months[short_months.index(month)]} {day}'
                            f' had a mean temperature of at least {temp}{degree_sign}C.')]
-    day_records_title_min = f'Record lows on {long_months[short_months.index(month)]} {day}:'
-    day_records_title_max = f'Record highs on {long_months[short_months.index(month)]} {day}:'
-    day_records_min, day_records_max = hadcet.get_day_records(short_months.index(month) + 1, day)
-    return day_hist, day_recent_title, day_recent_5yr.to_dict('records'), day_perc_geq, \
-           day_records_title_min, day_records_title_max, \
-           day_records_min.to_dict('records'), day_records_max.to_dict('records')
+    return temp, day_perc_geq
+
+
+# put the new bar heights/title and the vline position into the histogram already in the browser
+app.clientside_callback(
+    """
+    function(patch, temp, figure) {
+        if (!figure) {
+            return window.dash_clientside.no_update;
+        }
+        var data = figure.data;
+        var layout = Object.assign({}, figure.layout);
+        if (patch) {
+            data = [Object.assign({}, data[0], {y: patch.y, name: patch.name})];
+            layout.title = Object.assign({}, layout.title, {text: patch.title});
+        }
+        if (temp !== null && temp !== undefined) {
+            layout.shapes = [Object.assign({}, layout.shapes[0], {x0: temp, x1: temp})];
+        }
+        layout.datarevision = (patch ? patch.title : '') + '-' + temp;
+        return Object.assign({}, figure, {data: data, layout: layout});
+    }
+    """,
+    Output(component_id='day-hist', component_property='figure'),
+    Input(component_id='day-hist-patch', component_property='data'),
+    Input(component_id='day-hist-temp', component_property='data'),
+    State(component_id='day-hist', component_property='figure'))
 
 
 
@@ -360,18 +515,163 @@ def update_part3_options(multi_year):
 
 
 # PART 3 CALLBACK 2 - UPDATE MULTI-SELECT YEAR TABLE, GRAPH
+#  the previous patch tells us which years are already drawn, so only newly added years get a trace sent
 @app.callback(
     output=[Output(component_id='year-comparison-table', component_property='data'),
-            Output(component_id='year-comparison-graph', component_property='figure')],
+            Output(component_id='year-comparison-patch', component_property='data')],
     inputs=[
-        Input(component_id='multi-year-input', component_property='value')])
-def update_part3(multi_year):
+        Input(component_id='multi-year-input', component_property='value')],
+    state=[
+        State(component_id='year-comparison-patch', component_property='data')])
+@timed_callback
+@cache.memoize(key=lambda multi_year, drawn: (tuple(int(year) for year in multi_year),
+                                              (tuple(drawn['years']), drawn['window_size']) if drawn else None))
+def update_part3(multi_year, drawn):
     years = [int(year) for year in multi_year]
     if years == 0:
         return start_year_comp_table.to_dict('records')
-    year_comparison_table = hadcet.get_year_comp_table(years)
-    year_comparison_graph = plot.get_year_comparison_graph(years, 29)
-    return year_comparison_table.to_dict('records'), year_comparison_graph
+    with stage('model'):
+        year_comparison_table = hadcet.get_year_comp_table(years)
+    # before the first patch is applied, the start graph's year traces don't count as drawn (it uses a different window)
+    drawn_years, drawn_window_size = (drawn['years'], drawn['window_size']) if drawn else ([], None)
+    with stage('plot'):
+        year_comparison_patch = plot.get_year_comparison_patch(years, 29, drawn_years, drawn_window_size)
+    with stage('table'):
+        year_comparison_records = year_comparison_table.to_dict('records')
+    return year_comparison_records, year_comparison_patch
+
+
+# rebuild the graph's trace list from the patch: the all-time average stays first, kept years are pulled from the
+#  current figure (and recolored), new years come from the patch and reuse the all-time x values
+app.clientside_callback(
+    """
+    function(patch, figure) {
+        if (!patch || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var x = figure.data[0].x;
+        var data = [figure.data[0]];
+        patch.traces.forEach(function(t) {
+            if (t.trace) {
+                data.push(Object.assign({}, t.trace, {x: x}));
+            } else {
+                var old = figure.data[t.keep + 1];
+                data.push(Object.assign({}, old, {line: Object.assign({}, old.line, {color: t.color})}));
+            }
+        });
+        var layout = Object.assign({}, figure.layout, {datarevision: patch.years.join('-') + '-' + patch.window_size});
+        return Object.assign({}, figure, {data: data, layout: layout});
+    }
+    """,
+    Output(component_id='year-comparison-graph', component_property='figure'),
+    Input(component_id='year-comparison-patch', component_property='data'),
+    State(component_id='year-comparison-graph', component_property='figure'))
+
+
+# PART 4 CALLBACK - RESAMPLE THE FULL RECORD FOR THE ZOOMED-IN RANGE
+@app.callback(
+    output=Output(component_id='timeline-patch', component_property='data'),
+    inputs=[
+        Input(component_id='timeline', component_property='relayoutData')])
+@timed_callback
+def update_part4(relayout_data):
+    # zooming sends 'xaxis.range[0]'/'xaxis.range[1]' (or 'xaxis.range'), double-click/reset sends autorange
+    relayout_data = relayout_data or {}
+    if 'xaxis.range[0]' in relayout_data:
+        start, end = relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    elif 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+    elif relayout_data.get('xaxis.autorange'):
+        start, end = None, None
+    else:
+        # y-only zooms, resizes etc. don't change which points we need
+        raise PreventUpdate
+    with stage('plot'):
+        timeline_patch = plot.get_timeline_patch(start, end)
+    return timeline_patch
+
+
+# swap the new points into the three timeline traces, leaving their styling and the layout (and zoom) alone
+app.clientside_callback(
+    """
+    function(patch, figure) {
+        if (!patch || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var data = figure.data.map(function(trace, i) {
+            return Object.assign({}, trace, {x: patch.traces[i].x, y: patch.traces[i].y});
+        });
+        var layout = Object.assign({}, figure.layout, {datarevision: patch.start + '-' + patch.end});
+        return Object.assign({}, figure, {data: data, layout: layout});
+    }
+    """,
+    Output(component_id='timeline', component_property='figure'),
+    Input(component_id='timeline-patch', component_property='data'),
+    State(component_id='timeline', component_property='figure'))
+
+
+# PART 5 CALLBACK - AGGREGATE THE HEATMAP FOR THE ZOOMED-IN VIEW
+#  the previous patch remembers the view, since zooming along one axis only sends that axis's range
+@app.callback(
+    output=Output(component_id='heatmap-patch', component_property='data'),
+    inputs=[
+        Input(component_id='heatmap', component_property='relayoutData')],
+    state=[
+        State(component_id='heatmap-patch', component_property='data')])
+@timed_callback
+def update_part5(relayout_data, previous):
+    relayout_data = relayout_data or {}
+    x0, x1, y0, y1 = previous['range'] if previous else [None] * 4
+    changed = False
+    for axis in ['xaxis', 'yaxis']:
+        if f'{axis}.range[0]' in relayout_data:
+            ends = [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+        elif f'{axis}.range' in relayout_data:
+            ends = relayout_data[f'{axis}.range']
+        elif relayout_data.get(f'{axis}.autorange'):
+            ends = [None, None]
+        else:
+            continue
+        # the year axis is reversed, so its range comes top (earliest) first either way
+        ends = sorted(ends) if None not in ends else ends
+        x0, x1, y0, y1 = ends + [y0, y1] if axis == 'xaxis' else [x0, x1] + ends
+        changed = True
+    if not changed:
+        raise PreventUpdate
+    with stage('plot'):
+        heatmap_patch = plot.get_heatmap_patch(x0, x1, y0, y1)
+    return heatmap_patch
+
+
+# unpack the int16 anomalies (tenths of a degree, -32768 for no data) into the heatmap, leaving the layout alone
+app.clientside_callback(
+    """
+    function(patch, figure) {
+        if (!patch || !figure) {
+            return window.dash_clientside.no_update;
+        }
+        var bytes = atob(patch.z);
+        var view = new DataView(new ArrayBuffer(bytes.length));
+        for (var i = 0; i < bytes.length; i++) {
+            view.setUint8(i, bytes.charCodeAt(i));
+        }
+        var z = [];
+        for (var r = 0; r < patch.shape[0]; r++) {
+            var row = new Array(patch.shape[1]);
+            for (var c = 0; c < patch.shape[1]; c++) {
+                var value = view.getInt16(2 * (r * patch.shape[1] + c), true);
+                row[c] = value === -32768 ? null : value * patch.scale;
+            }
+            z.push(row);
+        }
+        var trace = Object.assign({}, figure.data[0], {x: patch.x, y: patch.y, z: z});
+        var layout = Object.assign({}, figure.layout, {datarevision: patch.level + ':' + patch.range.join(',')});
+        return Object.assign({}, figure, {data: [trace], layout: layout});
+    }
+    """,
+    Output(component_id='heatmap', component_property='figure'),
+    Input(component_id='heatmap-patch', component_property='data'),
+    State(component_id='heatmap', component_property='figure'))
 
 
 ###########################################
@@ -398,7 +698,9 @@ app.layout = dbc.Container(children=[
     layout_part2_row1, html.Br(),
     layout_part2_row2, html.Br(), html.Br(),
     layout_part3, html.Br(), html.Br(),
-    layout_part4, html.Br(), html.Br()
+    layout_part4, html.Br(), html.Br(),
+    layout_part5, html.Br(), html.Br(),
+    layout_part6, html.Br(), html.Br()
 ])
 
 if __name__ == '__main__':
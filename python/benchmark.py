@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+
+import numpy as np
+import pandas as pd
+import plotly
+from plotly.utils import PlotlyJSONEncoder
+
+from python.data import read_local_hadcet_data, flatten_time, get_rolling_ave
+from python.model import Model
+from python.plot import Plot
+from python.synthetic import write_synthetic_stations, get_scaled_shape, real_n_years
+
+
+# runs func repeat times, returns the fastest, median, and mean time in seconds
+def time_stage(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    return {'repeat': repeat, 'min': min(times), 'median': float(np.median(times)), 'mean': float(np.mean(times))}
+
+
+# every stage that gets timed, in order: (name, function taking the stage results so far). each function returns
+#  what later stages need (ex. the parsed df, the Model), or None. series is the registry of every file in data_dir
+def get_stages(data_dir, series):
+    # dates/years the queries use, taken from the end of whatever record is loaded
+    def last_year(model):
+        return int(model.df[(model.df['month'] == 12) & (model.df['day'] == 31)]['year'].max())
+
+    def to_json(obj):
+        return json.dumps(obj, cls=PlotlyJSONEncoder)
+
+    return [
+        ('parse', lambda r: read_local_hadcet_data('hadcet_mean.txt', data_dir)),
+        ('flatten', lambda r: flatten_time(r['parse'])),
+        ('rolling_ave', lambda r: get_rolling_ave(r['flatten'].values, 29)),
+        ('model_build', lambda r: Model(local_data=True, data_dir=data_dir, series=series)),
+        ('model.get_daily_ave_df', lambda r: r['model_build'].get_daily_ave_df()),
+        ('model.get_rank_matrix', lambda r: r['model_build'].get_rank_matrix()),
+        ('model.get_unusual_days', lambda r: r['model_build'].get_unusual_days(last_year(r['model_build']))),
+        ('model.get_day_hist_counts', lambda r: r['model_build'].get_day_hist_counts()),
+        ('model.get_day_prev_5yr', lambda r: r['model_build'].get_day_prev_5yr(12, 25)),
+        ('model.get_day_records', lambda r: r['model_build'].get_day_records(12, 25)),
+        ('model.get_perc_geq', lambda r: r['model_build'].get_perc_geq(12, 25, 5)),
+        ('model.get_year_comp_table', lambda r: r['model_build'].get_year_comp_table(
+            [last_year(r['model_build']) - i for i in range(5)])),
+        ('plot_build', lambda r: Plot(r['model_build'].df, r['model_build'].ave_df, r['model_build'].day_hist,
+                                      r['model_build'].year_matrix, r['model_build'].main_series)),
+        ('plot.get_alltime_traces', lambda r: r['plot_build'].get_alltime_traces()),
+        ('plot.get_year_trace', lambda r: r['plot_build'].get_year_trace(last_year(r['model_build']), 29, 0)),
+        ('plot.get_lineplot', lambda r: r['plot_build'].get_lineplot(last_year(r['model_build']), 29)),
+        ('plot.get_lineplot_patch', lambda r: r['plot_build'].get_lineplot_patch(last_year(r['model_build']), 29)),
+        ('plot.get_day_hist', lambda r: r['plot_build'].get_day_hist(12, 25, 5)),
+        ('plot.get_day_hist_patch', lambda r: r['plot_build'].get_day_hist_patch(12, 25)),
+        ('plot.get_year_comparison_graph', lambda r: r['plot_build'].get_year_comparison_graph(
+            [last_year(r['model_build']) - i for i in range(5)], 29)),
+        ('plot.get_year_comparison_patch', lambda r: r['plot_build'].get_year_comparison_patch(
+            [last_year(r['model_build']) - i for i in range(5)], 29)),
+        ('plot.get_timeline_pyramid', lambda r: r['plot_build'].get_timeline_pyramid()),
+        ('plot.get_timeline', lambda r: r['plot_build'].get_timeline()),
+        ('plot.get_timeline_patch', lambda r: r['plot_build'].get_timeline_patch('1900-01-01', '1950-01-01')),
+        ('plot.get_timeline_patch_zoomed_out',
+         lambda r: r['plot_build'].get_timeline_patch('1647-05-03 12:34:56.789', '2146-08-01 03:25:03.211')),
+        ('plot.get_heatmap_levels', lambda r: r['plot_build'].get_heatmap_levels()),
+        ('plot.get_heatmap', lambda r: r['plot_build'].get_heatmap()),
+        ('plot.get_heatmap_patch', lambda r: r['plot_build'].get_heatmap_patch(0, 180, 1900, 1950)),
+        ('serialize.lineplot', lambda r: r['plot.get_lineplot'].to_json()),
+        ('serialize.lineplot_patch', lambda r: to_json(r['plot.get_lineplot_patch'])),
+        ('serialize.day_hist', lambda r: r['plot.get_day_hist'].to_json()),
+        ('serialize.day_hist_patch', lambda r: to_json(r['plot.get_day_hist_patch'])),
+        ('serialize.year_comparison_graph', lambda r: r['plot.get_year_comparison_graph'].to_json()),
+        ('serialize.year_comparison_patch', lambda r: to_json(r['plot.get_year_comparison_patch'])),
+        ('serialize.timeline', lambda r: r['plot.get_timeline'].to_json()),
+        ('serialize.timeline_patch', lambda r: to_json(r['plot.get_timeline_patch'])),
+        ('serialize.heatmap', lambda r: r['plot.get_heatmap'].to_json()),
+        ('serialize.heatmap_patch', lambda r: to_json(r['plot.get_heatmap_patch'])),
+    ]
+
+
+# times every stage on synthetic data at each scale (1 = the real record). bigger scales get more years until pandas
+#  timestamps run out, then more series (see get_scaled_shape), so parse/flatten/rolling_ave (one file) stop growing
+#  past about 2x while model_build and anything over every series keep growing. a stage that fails is recorded with
+#  its error, and anything that needs its result is skipped
+def run_benchmarks(scales=(1, 10, 100), repeat=5):
+    with tempfile.TemporaryDirectory(prefix='hadcet_bench_') as work_dir:
+        results = [result for scale in scales for result in run_scale(work_dir, scale, repeat)]
+
+    return {'meta': get_meta(repeat), 'results': results}
+
+
+def run_scale(work_dir, scale, repeat):
+    results = []
+    n_years, n_series = get_scaled_shape(scale)
+    data_dir = os.path.join(work_dir, f'scale{scale}')
+    series = write_synthetic_stations(data_dir, n_series, n_years / real_n_years)
+    print(f'{scale:>5}x  {n_years} years x {n_series} series')
+    stage_results = {}
+    failed = set()
+    for name, func in get_stages(data_dir, series):
+        entry = {'scale': scale, 'years': n_years, 'series': n_series, 'stage': name}
+        try:
+            # one untimed run first, which also gives later stages their input
+            stage_results[name] = func(stage_results)
+            entry.update(time_stage(lambda: func(stage_results), repeat))
+        except Exception as e:
+            skipped = isinstance(e, KeyError) and e.args[0] in failed
+            entry['error'] = f'skipped, needs {e.args[0]}' if skipped else f'{type(e).__name__}: {e}'
+            failed.add(name)
+        results.append(entry)
+        print(f"{scale:>5}x  {name:<36}" +
+              (f"{entry['median'] * 1000:>10.2f}ms" if 'median' in entry else f"  {entry['error']}"))
+
+    return results
+
+
+# times building a Model from n_series synthetic series (each as long as the real record) for each count in
+#  series_counts, along with the peak memory python allocated while building it, to check both grow linearly
+def run_series_benchmarks(series_counts=(3, 12, 48), repeat=3):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='hadcet_bench_') as work_dir:
+        for n_series in series_counts:
+            data_dir = os.path.join(work_dir, f'series{n_series}')
+            series = write_synthetic_stations(data_dir, n_series)
+            entry = {'series': n_series, 'stage': 'model_build'}
+            entry.update(time_stage(lambda: Model(local_data=True, data_dir=data_dir, series=series), repeat))
+
+            tracemalloc.start()
+            model = Model(local_data=True, data_dir=data_dir, series=series)
+            entry['peak_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+            entry['temps_mb'] = model.temps.nbytes / 2 ** 20
+            results.append(entry)
+            print(f"{n_series:>5} series  {entry['median'] * 1000:>10.2f}ms  {entry['median'] / n_series * 1000:>8.2f}"
+                  f"ms/series  peak {entry['peak_mb']:>8.1f}MB  temps {entry['temps_mb']:>7.1f}MB")
+
+    return results
+
+
+# enough about the run to know whether two result files are comparable
+def get_meta(repeat):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'repeat': repeat,
+            'python': sys.version.split()[0], 'platform': platform.platform(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'plotly': plotly.__version__}
+
+
+# prints median times of two result files side by side (new/old < 1 means faster)
+def compare(old, new):
+    old_medians = {(r['scale'], r['stage']): r.get('median') for r in old['results']}
+    for r in new['results']:
+        before, after = old_medians.get((r['scale'], r['stage'])), r.get('median')
+        if before and after:
+            print(f"{r['scale']:>5}x  {r['stage']:<36}{before * 1000:>10.2f}ms{after * 1000:>10.2f}ms"
+                  f"{after / before:>8.2f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Time parsing, model building, queries, plots, and serialization')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--out', help='where to write the results as json')
+    parser.add_argument('--compare', help='an earlier results json to compare against')
+    parser.add_argument('--series', type=int, nargs='*', default=[],
+                        help='also time model building with this many series (ex. 3 12 48)')
+    args = parser.parse_args()
+
+    bench = run_benchmarks([int(s) if s == int(s) else s for s in args.scales], args.repeat)
+    if args.series:
+        bench['series_results'] = run_series_benchmarks(args.series, args.repeat)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(bench, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), bench)
@@ -0,0 +1,201 @@
+import os
+import stat
+import time
+import pickle
+import shutil
+import hashlib
+import tempfile
+import threading
+import functools
+from collections import OrderedDict
+
+
+# the default shared directory, one per user so no one else's files are ever unpickled
+def get_default_cache_dir():
+    user = os.getuid() if hasattr(os, 'getuid') else 'user'
+    return os.path.join(tempfile.gettempdir(), f'hadcet_cache_{user}')
+
+
+# unpickling runs whatever code the file says to, so the shared directory must be ours alone: created with mode 700
+#  if it's missing, and refused if it's a symlink, someone else's, or writable by anyone else (ex. made first by
+#  another user in /tmp)
+def check_private_dir(path):
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if stat.S_ISLNK(info.st_mode) or not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f'cache dir {path} is not a plain directory')
+    # windows has no uids or unix permissions (and its temp dir is already per user)
+    if hasattr(os, 'getuid') and (info.st_uid != os.getuid() or info.st_mode & 0o077):
+        raise PermissionError(f'cache dir {path} must belong to this user and be closed to everyone else '
+                              f'(mode 700), set HADCET_CACHE_DIR to a private directory')
+
+    return path
+
+
+# fingerprint of the code that produces the cached results, so a deploy that changes what a callback returns doesn't
+#  get served results pickled by the old code
+def get_code_version(code_files):
+    digest = hashlib.sha1()
+    for path in sorted(code_files):
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+
+    return digest.hexdigest()[:12]
+
+
+# two-level cache for callback results: a small LRU in each process, backed by a directory of pickles that every
+#  gunicorn worker on the machine shares. a missing entry is computed by one thread of one worker while the others
+#  wait for it (so e.g. Christmas only gets computed once, not once per worker)
+class CallbackCache:
+
+    def __init__(self, version, cache_dir=None, max_size=512, ttl=24 * 60 * 60, code_files=(), lock_timeout=30):
+        # results are only ever looked up under the current dataset version and code version, so new data or new
+        #  code means new entries
+        self.version = str(version)
+        self.code_version = get_code_version(code_files)
+        self.cache_dir = check_private_dir(cache_dir or get_default_cache_dir())
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        # the LRU is shared by all of a worker's threads, the lock is only held for lookups, never while computing
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.hits = {'memory': 0, 'shared': 0, 'miss': 0}
+        # threads computing the same entry queue up on the same one of these (and so, rarely, on another entry's)
+        self.key_locks = [threading.Lock() for _ in range(64)]
+        os.makedirs(self.version_dir(), mode=0o700, exist_ok=True)
+
+    def version_dir(self):
+        return os.path.join(self.cache_dir, f'{self.version}-{self.code_version}')
+
+    # wraps a callback so its result is cached, 'key' turns the callback's inputs into their normalized form
+    #  (ex. 'jan' and 1 both mean January) so equivalent requests share an entry
+    def memoize(self, key=None):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                normalized = key(*args) if key is not None else args
+                digest = hashlib.sha1(repr((func.__name__, normalized)).encode()).hexdigest()
+                return self.get_or_compute(digest, lambda: func(*args))
+            return wrapper
+        return decorator
+
+    def get_or_compute(self, digest, compute):
+        found, value = self.lookup(digest)
+        if found:
+            return value
+
+        # only one thread per worker gets past here for an entry, the rest find its result in the LRU afterwards
+        with self.key_locks[int(digest[:8], 16) % len(self.key_locks)]:
+            found, value = self.lookup(digest)
+            if found:
+                return value
+
+            # and only one worker: the one that creates the entry's lock file computes it, the others wait for the
+            #  entry to show up in the shared directory
+            path = os.path.join(self.version_dir(), digest + '.pkl')
+            has_lock = self.acquire_file_lock(path + '.lock', digest)
+            try:
+                # (the worker before us may have just finished, even if we got the lock)
+                found, value = self.lookup(digest)
+                if found:
+                    return value
+                with self.lock:
+                    self.hits['miss'] += 1
+                value = compute()
+                self.remember(digest, value, time.time() + self.ttl)
+
+                # write to a temp file and rename it, so other workers never read a partly written entry
+                try:
+                    os.makedirs(self.version_dir(), mode=0o700, exist_ok=True)
+                    fd, tmp_path = tempfile.mkstemp(dir=self.version_dir(), suffix='.tmp')
+                    with os.fdopen(fd, 'wb') as f:
+                        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                    os.replace(tmp_path, path)
+                except OSError:
+                    pass
+            finally:
+                if has_lock:
+                    try:
+                        os.remove(path + '.lock')
+                    except OSError:
+                        pass
+
+        return value
+
+    # returns (True, value) from this process's LRU or else the shared directory, which other workers may have filled
+    #  in already, or (False, None)
+    def lookup(self, digest):
+        now = time.time()
+        with self.lock:
+            if digest in self.memory:
+                expires, value = self.memory[digest]
+                if expires > now:
+                    self.memory.move_to_end(digest)
+                    self.hits['memory'] += 1
+                    return True, value
+                del self.memory[digest]
+
+        path = os.path.join(self.version_dir(), digest + '.pkl')
+        try:
+            expires = os.path.getmtime(path) + self.ttl
+            if expires > now:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+                with self.lock:
+                    self.hits['shared'] += 1
+                self.remember(digest, value, expires)
+                return True, value
+        except (OSError, EOFError, pickle.UnpicklingError):
+            # missing, half-written by a worker that died, or removed by invalidate() in the meantime
+            pass
+
+        return False, None
+
+    # creates the lock file and returns True, or returns False once the entry has been written by the worker holding
+    #  it (or that worker has taken longer than lock_timeout, in which case we compute it ourselves too). a lock file
+    #  older than lock_timeout was left by a worker that died while computing, and is taken over
+    def acquire_file_lock(self, lock_path, digest):
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+                return True
+            except FileExistsError:
+                pass
+            except OSError:
+                # ex. the version folder was removed, then just compute it
+                return False
+            if os.path.exists(os.path.join(self.version_dir(), digest + '.pkl')) or time.time() > deadline:
+                return False
+            try:
+                if os.path.getmtime(lock_path) + self.lock_timeout < time.time():
+                    os.remove(lock_path)
+                    continue
+            except OSError:
+                continue
+            time.sleep(.02)
+
+    def remember(self, digest, value, expires):
+        with self.lock:
+            self.memory[digest] = (expires, value)
+            self.memory.move_to_end(digest)
+            while len(self.memory) > self.max_size:
+                self.memory.popitem(last=False)
+
+    # called when the data is refreshed: switches to the new version and drops the entries of other versions. workers
+    #  that haven't refreshed yet may still be using theirs, so a version's folder is only removed once nothing has
+    #  been written to it for a whole ttl (its entries would all have expired by then anyway)
+    def invalidate(self, version):
+        self.version = str(version)
+        with self.lock:
+            self.memory.clear()
+        now = time.time()
+        for entry in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, entry)
+            try:
+                if path != self.version_dir() and os.path.getmtime(path) + self.ttl < now:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+        os.makedirs(self.version_dir(), mode=0o700, exist_ok=True)
@@ -1,9 +1,15 @@
 import pandas as pd
 import numpy as np
-import datetime
 import requests
+import os
+from types import MappingProxyType
+
+# where read_local_hadcet_data() looks for the .txt files unless told otherwise
+local_data_dir = 'C:/Users/alueh/Desktop/NEXT/Hadcet Dashboard/data/'
 
 months = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+# leap year month lengths, so that every (month, day) gets its own slot in a 366-day calendar
+month_lengths = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
 
 # use this function if the data is being accessed via 'requests'
 def download_hadcet_data(url):
@@ -31,9 +37,9 @@ def download_hadcet_data(url):
 
 
 # use this function if the data is being accessed locally
-def read_local_hadcet_data(filename):
+def read_local_hadcet_data(filename, data_dir=local_data_dir):
 
-    with open('C:/Users/alueh/Desktop/NEXT/Hadcet Dashboard/data/' + filename) as f:
+    with open(os.path.join(data_dir, filename)) as f:
         data = [[int(x) for x in row.replace('\n', '').split()] for row in f.readlines()]
 
     df = pd.DataFrame(data)
@@ -51,58 +57,79 @@ def read_local_hadcet_data(filename):
 
 # data is 1D, but in 2D structure, need to flatten it
 def flatten_time(df):
-    
-    # create empty Series to hold ALL temperatures
-    temperatures = pd.Series(dtype='float64')
-    
-    # identify initial and final years of the dataset
-    firstyear = df['year'].min()
-    finalyear = df['year'].max()
-
-    # initialize other variables
-    finalmonth = -1
-    finalday = -1
-    
-    # for each year, flatten the data and append to the temperatures Series
-    for yr in range(firstyear, finalyear+1):
-        
-        # slice out just one years' data from the overall df
-        yrdf = df[df['year'] == yr]
-        
-        # if its the final year of dataset, find the final month and day of data
-        if yr == finalyear:
-            
-            # find first col of all -999; month previous is our finalmonth
-            finalmonth = -1
-            for i, mo in enumerate(months):
-                if all(yrdf[mo] == -999):
-                    finalmonth = i
-                    break
-            # if no cols were filled with -999, december must be last month
-            if finalmonth == -1:
-                finalmonth = 12
-            
-            # final day is 31 minus number of -999s in the final col
-            finalday = 31 - sum(yrdf.iloc[:, finalmonth+1] == -999)
-            
-        # now (un?)ravel all of the temps into one list, drop nans==-999
-        yrtemps = yrdf[months].to_numpy().T.ravel()*.1
-        yrtemps = np.delete(yrtemps, np.where(yrtemps == -99.9))
-
-        # create datetime index using finalyr/month/day info we got
-        sdate = datetime.date(yr, 1, 1)
-        #print(finalyear, finalmonth, finalday)
-        edate = datetime.date(yr, 12, 31) if yr < finalyear else datetime.date(finalyear, finalmonth, finalday)
-        delta = edate - sdate
-        idx = pd.date_range(sdate, edate).tolist()
-
-        # create Series with index=datetime, values=temperatures, append to overall Series
-        yr_ser = pd.Series(yrtemps, index=idx)
-        temperatures = temperatures.append(yr_ser)
-    
+
+    # every cell of the file is one (year, day, month), spell those out for all the cells at once
+    temps = df[months].to_numpy().ravel()
+    years = np.repeat(df['year'].to_numpy(), 12)
+    days = np.repeat(df['day'].to_numpy(), 12)
+    month_nums = np.tile(np.arange(1, 13), len(df))
+
+    # put the cells in date order (each year month by month), then drop the -999s (days that don't exist, like
+    #  Feb 30, and days after the end of the record)
+    order = np.lexsort((days, month_nums, years))
+    order = order[temps[order] != -999]
+
+    # create Series with index=datetime, values=temperatures
+    dates = pd.to_datetime(pd.DataFrame({'year': years[order], 'month': month_nums[order], 'day': days[order]}))
+    temperatures = pd.Series(temps[order] * .1, index=pd.DatetimeIndex(dates))
+
     return temperatures
 
 
+# makes an array read-only, so anything that tries to write into shared data raises an error instead of quietly
+#  changing it for every other thread reading it
+def freeze(data):
+    data.flags.writeable = False
+
+    return data
+
+
+# a DataFrame can always be changed in place (a column assigned, a row dropped), so tables that threads share are kept
+#  as a read-only mapping of read-only column arrays instead, and handed out with to_frame()
+def freeze_columns(df):
+    return MappingProxyType({col: freeze(df[col].to_numpy(copy=True)) for col in df.columns})
+
+
+# a new DataFrame of frozen columns for one caller. pandas copies the columns into it, so whatever the caller does
+#  to the frame stays with them
+def to_frame(columns):
+    return pd.DataFrame(dict(columns))
+
+
+# read-only mappings (MappingProxyType) can't be pickled, so before pickling a read-only snapshot every one of them
+#  (even nested in other mappings or tuples) is swapped for a plain dict
+def thaw(data):
+    if isinstance(data, MappingProxyType):
+        return {key: thaw(value) for key, value in data.items()}
+    if isinstance(data, tuple):
+        return tuple(thaw(value) for value in data)
+    return data
+
+
+# undoes thaw() after unpickling: dicts go back to read-only mappings, and arrays (which always come back writeable)
+#  are frozen again
+def refreeze(data):
+    if isinstance(data, dict):
+        return MappingProxyType({key: refreeze(value) for key, value in data.items()})
+    if isinstance(data, tuple):
+        return tuple(refreeze(value) for value in data)
+    if isinstance(data, np.ndarray):
+        return freeze(data)
+    return data
+
+
+# index (0-365) of each date in a 366-day calendar, so Feb 29 is always 59 and Mar 1 is always 60. dates that don't
+#  exist (ex. Feb 31, which would otherwise land on Mar 2) raise a ValueError
+def get_calendar_day(month, day):
+    month, day = np.asarray(month), np.asarray(day)
+    if np.any((month < 1) | (month > 12)):
+        raise ValueError(f'no such month: {month}')
+    if np.any((day < 1) | (day > np.asarray(month_lengths)[month - 1])):
+        raise ValueError(f'no such day: {month}/{day}')
+    offsets = np.concatenate(([0], np.cumsum(month_lengths)[:-1]))
+    return offsets[month - 1] + day - 1
+
+
 # we'll want to add some rolling average columns
 def get_rolling_ave(array, size, fillna=False):
     # compute rolling average (the smart way)
@@ -118,6 +145,21 @@ def get_rolling_ave(array, size, fillna=False):
     return result
 
 
+# min/max decimation: split the series into buckets of bucket_size points and keep only the lowest and highest point
+#  of each bucket (in time order), so record highs and lows survive the downsampling. leftover points at the end are
+#  kept as they are
+def minmax_decimate(x, y, bucket_size):
+    n_buckets = len(y) // bucket_size
+    n = n_buckets * bucket_size
+    buckets = y[:n].reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
+    lows = buckets.argmin(axis=1) + offsets
+    highs = buckets.argmax(axis=1) + offsets
+    idx = np.concatenate((np.unique(np.concatenate((lows, highs))), np.arange(n, len(y))))
+
+    return x[idx], y[idx]
+
+
 ##################################################################################
 ### All of the below of this code is functions that became methods in model.py ###
 ### The above four functions are still imported intho model.py and plot.py     ###
@@ -0,0 +1,108 @@
+import os
+import time
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+from python.data import month_lengths
+from python.model import Model
+from python.plot import Plot
+
+# images are only written if plotly's static image renderer (kaleido) is installed
+has_image_renderer = importlib.util.find_spec('kaleido') is not None
+
+# each worker process gets its own Model/Plot once, through init_worker(), instead of having them pickled per task
+worker_model = None
+worker_plot = None
+
+
+def init_worker(model):
+    global worker_model, worker_plot
+    worker_model = model
+    worker_plot = Plot(model.df, model.ave_df, model.day_hist, model.year_matrix, model.main_series)
+
+
+# (Part 1) writes the lineplot for one year and window size
+def export_year(args):
+    out_dir, year, window_size, images = args
+    start = time.perf_counter()
+
+    name = f'{year}_window{window_size}'
+    lineplot = worker_plot.get_lineplot(year, window_size)
+    lineplot.write_json(os.path.join(out_dir, 'part1', name + '.json'))
+    if images:
+        lineplot.write_image(os.path.join(out_dir, 'part1', name + '.png'))
+
+    return f'part1/{name}', time.perf_counter() - start
+
+
+# (Part 2) writes the histogram and the three tables for one calendar date
+def export_date(args):
+    out_dir, month, day, temp, images = args
+    start = time.perf_counter()
+
+    name = f'{month:02d}-{day:02d}'
+    day_hist = worker_plot.get_day_hist(month, day, temp)
+    day_hist.write_json(os.path.join(out_dir, 'part2', name + '_hist.json'))
+    if images:
+        day_hist.write_image(os.path.join(out_dir, 'part2', name + '_hist.png'))
+    worker_model.get_day_prev_5yr(month, day).to_csv(os.path.join(out_dir, 'part2', name + '_recent.csv'),
+                                                     index=False)
+    record_lows, record_highs = worker_model.get_day_records(month, day)
+    record_lows.to_csv(os.path.join(out_dir, 'part2', name + '_record_lows.csv'), index=False)
+    record_highs.to_csv(os.path.join(out_dir, 'part2', name + '_record_highs.csv'), index=False)
+
+    return f'part2/{name}', time.perf_counter() - start
+
+
+# fans every year/window and every date out over a process pool, writes a timings.csv with how long each item took.
+#  reads the data files from data_dir if it's given, otherwise downloads them
+def export_all(out_dir, window_sizes=(1, 7, 29), temp=0, data_dir=None, workers=None, images=True):
+    images = images and has_image_renderer
+    for part in ['part1', 'part2']:
+        os.makedirs(os.path.join(out_dir, part), exist_ok=True)
+
+    start = time.perf_counter()
+    model = Model(local_data=True, data_dir=data_dir) if data_dir else Model(local_data=False)
+    load_time = time.perf_counter() - start
+
+    # only full years get a Part 1 figure
+    last_year = model.df[(model.df['month'] == 12) & (model.df['day'] == 31)]['year'].max()
+    year_tasks = [(out_dir, year, window_size, images)
+                  for year in range(model.df['year'].min(), last_year + 1) for window_size in window_sizes]
+    date_tasks = [(out_dir, month, day, temp, images)
+                  for month in range(1, 13) for day in range(1, month_lengths[month - 1] + 1)]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(model,)) as pool:
+        timings = list(pool.map(export_year, year_tasks, chunksize=16)) + \
+                  list(pool.map(export_date, date_tasks, chunksize=8))
+    export_time = time.perf_counter() - start
+
+    with open(os.path.join(out_dir, 'timings.csv'), 'w') as f:
+        f.write('item,seconds\n')
+        for name, seconds in timings:
+            f.write(f'{name},{seconds:.4f}\n')
+
+    item_times = sorted(seconds for _, seconds in timings)
+    print(f'loaded data in {load_time:.1f}s')
+    print(f'exported {len(timings)} items in {export_time:.1f}s ({len(timings) / export_time:.1f} items/s)'
+          + ('' if images else ', without images'))
+    print(f'per item: median {item_times[len(item_times) // 2] * 1000:.0f}ms, '
+          f'slowest {item_times[-1] * 1000:.0f}ms')
+
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export every Part 1 and Part 2 figure and table of the dashboard')
+    parser.add_argument('out_dir')
+    parser.add_argument('--window-sizes', type=int, nargs='+', default=[1, 7, 29])
+    parser.add_argument('--temp', type=float, default=0, help='where to draw the vline on the date histograms')
+    parser.add_argument('--data-dir', default=os.environ.get('HADCET_DATA_DIR'),
+                        help='folder with the data files (default $HADCET_DATA_DIR), downloads them if not set')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-images', action='store_true')
+    args = parser.parse_args()
+
+    export_all(args.out_dir, args.window_sizes, args.temp, args.data_dir, args.workers, not args.no_images)
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import shutil
+import tempfile
+import subprocess
+
+import numpy as np
+import requests
+
+short_months = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# each callback is found in /_dash-dependencies by one of its outputs, with how often users trigger it
+callbacks = {'part1': ('plot-patch', .3),
+             'part2': ('day-hist-patch', .15),
+             'part2_temp': ('day-hist-temp', .25),
+             'part3': ('year-comparison-patch', .2),
+             'part4': ('timeline-patch', .1),
+             'part5': ('heatmap-patch', .1)}
+
+# dates people look up far more than others
+popular_dates = [('dec', 25), ('jan', 1), ('jul', 4), ('feb', 29), ('oct', 31)]
+
+
+# one simulated user's current inputs. each request changes one of them, the way someone clicking around would
+class User:
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.year, self.window_size = 2020, 1
+        self.month, self.day, self.temp = 'jan', 1, 0
+        self.years, self.drawn = ['2020'], None
+        self.heatmap = None
+
+    def next_inputs(self, name):
+        rng = self.rng
+        if name == 'part1':
+            if rng.random() < .7:
+                self.year = rng.randint(1772, 2020)
+            else:
+                self.window_size = rng.randrange(1, 36, 2)
+            return [self.year, self.window_size]
+        if name == 'part2':
+            if rng.random() < .3:
+                self.month, self.day = rng.choice(popular_dates)
+            else:
+                self.month, self.day = rng.choice(short_months), rng.randint(1, 28)
+            return [self.month, self.day]
+        if name == 'part2_temp':
+            self.temp = rng.randint(-5, 25)
+            return [self.month, self.day, self.temp]
+        if name == 'part3':
+            # add a year, or drop one, keeping between 1 and 5 selected
+            if len(self.years) < 5 and (len(self.years) == 1 or rng.random() < .6):
+                # the dropdown only offers years that aren't selected yet
+                self.years = self.years + [rng.choice([str(y) for y in range(1772, 2021) if str(y) not in self.years])]
+            else:
+                dropped = rng.choice(self.years)
+                self.years = [y for y in self.years if y != dropped]
+            return [self.years]
+        if name == 'part4':
+            # zoom into a few decades, or out past both ends of the record (and of pandas' timestamps), the way the
+            #  modebar's "zoom out" does from the full view
+            if rng.random() < .2:
+                return [{'xaxis.range[0]': '1647-05-03 12:34:56.789', 'xaxis.range[1]': '2146-08-01 03:25:03.211'}]
+            start = rng.randint(1772, 2015)
+            return [{'xaxis.range[0]': f'{start}-01-01', 'xaxis.range[1]': f'{start + rng.randint(1, 40)}-01-01'}]
+        if name == 'part5':
+            # zoom into a box of days and years, or back out
+            if rng.random() < .2:
+                return [{'xaxis.autorange': True, 'yaxis.autorange': True}]
+            day, year = rng.uniform(0, 300), rng.uniform(1772, 2000)
+            return [{'xaxis.range[0]': day, 'xaxis.range[1]': day + rng.uniform(7, 66),
+                     'yaxis.range[0]': year + rng.uniform(5, 21), 'yaxis.range[1]': year}]
+
+
+# builds the POST body Dash's front end would send for a callback, from its entry in /_dash-dependencies
+def get_body(dependency, input_values, state_values):
+    outputs = [dict(zip(['id', 'property'], out.rsplit('.', 1)))
+               for out in dependency['output'].strip('.').split('...')]
+    inputs = [dict(inp, value=value) for inp, value in zip(dependency['inputs'], input_values)]
+    state = [dict(st, value=value) for st, value in zip(dependency['state'], state_values)]
+
+    # multi-output callbacks ('..a.b...c.d..') send a list of outputs, single-output ones just the one
+    multi = dependency['output'].startswith('..')
+
+    return {'output': dependency['output'], 'outputs': outputs if multi else outputs[0],
+            'inputs': inputs, 'state': state, 'changedPropIds': [f"{inputs[-1]['id']}.{inputs[-1]['property']}"]}
+
+
+# keeps one user sending requests until stop is set, appending (callback, seconds, status) to results
+def run_user(url, dependencies, seed, stop, results):
+    rng = random.Random(seed)
+    user = User(rng)
+    session = requests.Session()
+    names, weights = list(callbacks), [weight for _, weight in callbacks.values()]
+
+    while not stop.is_set():
+        name = rng.choices(names, weights)[0]
+        state = [user.drawn] if name == 'part3' else [user.heatmap] if name == 'part5' else []
+        body = get_body(dependencies[name], user.next_inputs(name), state)
+
+        start = time.perf_counter()
+        response = session.post(url + '/_dash-update-component', json=body)
+        seconds = time.perf_counter() - start
+        results.append((name, seconds, response.status_code))
+
+        # the browser would feed the new patch back in as state next time
+        if name == 'part3' and response.status_code == 200:
+            user.drawn = response.json()['response']['year-comparison-patch']['data']
+        if name == 'part5' and response.status_code == 200:
+            user.heatmap = response.json()['response']['heatmap-patch']['data']
+
+
+# resident memory (MB) of every process whose parent is pid, read from /proc (linux only)
+def get_worker_rss(pid):
+    rss = []
+    for entry in os.listdir('/proc'):
+        try:
+            with open(f'/proc/{entry}/status') as f:
+                status = dict(line.split(':', 1) for line in f.read().splitlines() if ':' in line)
+            if int(status['PPid']) == pid:
+                rss.append(int(status['VmRSS'].split()[0]) / 1024)
+        except (OSError, ValueError, KeyError):
+            continue
+
+    return rss
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+# starts 'gunicorn app:server' on the bundled data/ files, with its callback cache in cache_dir, and waits until it
+#  answers
+def start_server(workers, worker_class, threads, port, cache_dir, timeout=300):
+    env = dict(os.environ, HADCET_DATA_DIR=os.path.join(repo_dir, 'data'), HADCET_CACHE_DIR=cache_dir)
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:server', '--bind', f'127.0.0.1:{port}',
+                               '--workers', str(workers), '--worker-class', worker_class, '--threads', str(threads),
+                               '--timeout', str(timeout)],
+                              cwd=repo_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {server.returncode}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/_dash-dependencies', timeout=1).raise_for_status()
+            return server
+        except requests.RequestException:
+            time.sleep(.5)
+    server.terminate()
+    server.wait()
+    raise RuntimeError('gunicorn did not start in time')
+
+
+# one run: a server with the given workers, users concurrent users for duration seconds. every run gets its own empty
+#  callback cache, so runs don't warm each other up, and it's removed again afterwards
+def run_load(workers, worker_class, threads=1, users=8, duration=30, seed=0):
+    port = get_free_port()
+    url = f'http://127.0.0.1:{port}'
+    cache_dir = tempfile.mkdtemp(prefix='hadcet_loadtest_cache_')
+    server = None
+    try:
+        server = start_server(workers, worker_class, threads, port, cache_dir)
+        all_dependencies = requests.get(url + '/_dash-dependencies').json()
+        dependencies = {name: next(d for d in all_dependencies if f'{output}.' in d['output'])
+                        for name, (output, _) in callbacks.items()}
+
+        results = []
+        stop = threading.Event()
+        user_threads = [threading.Thread(target=run_user, args=(url, dependencies, seed + i, stop, results))
+                        for i in range(users)]
+        start = time.perf_counter()
+        for thread in user_threads:
+            thread.start()
+
+        # sample worker memory while the load runs, report the peak
+        peak_rss = []
+        while time.perf_counter() - start < duration:
+            rss = get_worker_rss(server.pid)
+            if sum(rss) > sum(peak_rss):
+                peak_rss = rss
+            time.sleep(1)
+        stop.set()
+        for thread in user_threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return summarize(results, elapsed, peak_rss, workers, worker_class, threads, users)
+
+
+def summarize(results, elapsed, peak_rss, workers, worker_class, threads, users):
+    summary = {'workers': workers, 'worker_class': worker_class, 'threads': threads, 'users': users,
+               'seconds': elapsed, 'requests': len(results), 'throughput': len(results) / elapsed,
+               'errors': sum(status != 200 for _, _, status in results),
+               'worker_rss_mb': peak_rss, 'total_rss_mb': sum(peak_rss), 'callbacks': {}}
+    for name in callbacks:
+        latencies = np.array([seconds for n, seconds, _ in results if n == name]) * 1000
+        if len(latencies):
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            summary['callbacks'][name] = {'requests': len(latencies), 'p50_ms': p50, 'p95_ms': p95, 'p99_ms': p99}
+
+    return summary
+
+
+def print_summary(summary):
+    print(f"\n{summary['workers']} x {summary['worker_class']} ({summary['threads']} threads), {summary['users']} users:"
+          f" {summary['throughput']:.1f} req/s, {summary['errors']} errors, "
+          f"{summary['total_rss_mb']:.0f}MB across {len(summary['worker_rss_mb'])} workers")
+    for name, stats in summary['callbacks'].items():
+        print(f"    {name:<12}{stats['requests']:>7} reqs   p50 {stats['p50_ms']:>7.1f}ms"
+              f"   p95 {stats['p95_ms']:>7.1f}ms   p99 {stats['p99_ms']:>7.1f}ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the dashboard callbacks through gunicorn')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--worker-classes', nargs='+', default=['sync', 'gthread'])
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker for gthread workers')
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--out', help='where to write the results as json')
+    args = parser.parse_args()
+
+    summaries = []
+    for worker_class in args.worker_classes:
+        for workers in args.workers:
+            threads = args.threads if worker_class == 'gthread' else 1
+            summaries.append(run_load(workers, worker_class, threads, args.users, args.duration))
+            print_summary(summaries[-1])
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(summaries, f, indent=2)
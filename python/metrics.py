@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context
+
+# upper bounds (in seconds) of the histogram buckets, the last bucket (+Inf) is implied
+buckets = [.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10]
+
+
+# cumulative histogram of how long each stage took, in the prometheus text format. every gunicorn worker keeps its
+#  own, so /metrics shows whichever worker answered
+class Histogram:
+
+    def __init__(self, name, help_text, label_name):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.sums = {}
+
+    def observe(self, label, seconds):
+        with self.lock:
+            if label not in self.counts:
+                self.counts[label] = [0] * (len(buckets) + 1)
+                self.sums[label] = 0.
+            # count goes into the first bucket it fits under, they're added up when rendering
+            i = next((i for i, le in enumerate(buckets) if seconds <= le), len(buckets))
+            self.counts[label][i] += 1
+            self.sums[label] += seconds
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label in sorted(self.counts):
+                total = 0
+                for le, count in zip([str(b) for b in buckets] + ['+Inf'], self.counts[label]):
+                    total += count
+                    lines.append(f'{self.name}_bucket{{{self.label_name}="{label}",le="{le}"}} {total}')
+                lines.append(f'{self.name}_sum{{{self.label_name}="{label}"}} {self.sums[label]:.6f}')
+                lines.append(f'{self.name}_count{{{self.label_name}="{label}"}} {total}')
+
+        return '\n'.join(lines)
+
+
+stage_seconds = Histogram('hadcet_stage_seconds', 'Time spent in each stage of startup and callbacks', 'stage')
+request_seconds = Histogram('hadcet_request_seconds', 'Time spent on whole requests', 'route')
+
+
+# times a block of code, ex. 'with stage("model"):'. inside a request the time also goes into that request's
+#  Server-Timing header (stages with the same name add up)
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        stage_seconds.observe(name, seconds)
+        if has_request_context() and 'timings' in g:
+            g.timings[name] = g.timings.get(name, 0) + seconds
+
+
+# goes between @app.callback and the callback, times the callback as a whole and marks when it finished, so the
+#  time Dash spends turning the result into json shows up as its own 'serialize' stage
+def timed_callback(func):
+    @functools.wraps(func)
+    def wrapper(*args):
+        with stage('callback.' + func.__name__):
+            result = func(*args)
+        if has_request_context():
+            g.callback_end = time.perf_counter()
+            g.callback_name = func.__name__
+        return result
+    return wrapper
+
+
+# samples the stack of one thread every interval seconds, the result is in the collapsed stack format (one
+#  'frame;frame;frame count' line per distinct stack) that flamegraph tools read
+class SamplingProfiler:
+
+    def __init__(self, thread_id, interval=.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.running = False
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self):
+        while self.running:
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+# what a request is labelled with in /metrics: the callback it ran, or else the flask route it matched (the pattern,
+#  never the raw url), or 'other'. so every url anyone requests doesn't get its own histogram
+def get_route():
+    if 'callback_name' in g:
+        return 'callback.' + g.callback_name
+    if request.url_rule is not None:
+        return request.url_rule.rule
+    return 'other'
+
+
+# hooks everything into the flask server: per-request stage timings, a Server-Timing header on every response, the
+#  /metrics endpoint, and (when HADCET_PROFILE_DIR is set) profiling of any request sent with an 'X-Profile: 1' header
+def install(server):
+    profile_dir = os.environ.get('HADCET_PROFILE_DIR')
+
+    @server.before_request
+    def start_timings():
+        g.timings = {}
+        if profile_dir and request.headers.get('X-Profile') == '1':
+            g.profiler = SamplingProfiler(threading.get_ident())
+            g.profiler.start()
+
+    @server.after_request
+    def finish_timings(response):
+        now = time.perf_counter()
+        if 'callback_end' in g:
+            g.timings['serialize'] = now - g.callback_end
+        if 'profiler' in g:
+            g.profiler.stop()
+            os.makedirs(profile_dir, exist_ok=True)
+            path = os.path.join(profile_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{threading.get_ident()}.txt')
+            with open(path, 'w') as f:
+                f.write(g.profiler.collapsed())
+            response.headers['X-Profile-File'] = path
+        # handed to the wsgi wrapper below, which adds the compression time once flask-compress is done
+        request.environ['hadcet.timings'] = g.timings
+        request.environ['hadcet.route'] = get_route()
+        request.environ['hadcet.after_request'] = now
+        return response
+
+    @server.route('/metrics')
+    def metrics():
+        return '\n'.join([stage_seconds.render(), request_seconds.render(), '']), 200, \
+               {'Content-Type': 'text/plain; version=0.0.4'}
+
+    # flask-compress compresses in its own after_request, which runs after ours, so the header gets written out here
+    wsgi_app = server.wsgi_app
+
+    def timed_wsgi_app(environ, start_response):
+        start = time.perf_counter()
+
+        def timed_start_response(status, headers, exc_info=None):
+            now = time.perf_counter()
+            timings = dict(environ.get('hadcet.timings', {}))
+            if 'hadcet.after_request' in environ:
+                timings['compress'] = now - environ['hadcet.after_request']
+            timings['total'] = now - start
+            request_seconds.observe(environ.get('hadcet.route', 'other'), timings['total'])
+            headers.append(('Server-Timing', ', '.join(f'{name};dur={seconds * 1000:.2f}'
+                                                        for name, seconds in timings.items())))
+            return start_response(status, headers, exc_info)
+
+        return wsgi_app(environ, timed_start_response)
+
+    server.wsgi_app = timed_wsgi_app
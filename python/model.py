@@ -1,147 +1,411 @@
+import hashlib
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import pandas as pd
-from python.data import read_local_hadcet_data, download_hadcet_data, flatten_time
+from python.metrics import stage
+from python.data import read_local_hadcet_data, download_hadcet_data, flatten_time, get_calendar_day, local_data_dir, \
+    freeze, freeze_columns, to_frame, thaw, refreeze, month_lengths
 
 months = ['jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec']
 
+# every daily series the Model knows how to load, by name: a local file name (in data_dir) and a url. any other daily
+#  record in the same year/day/12-month format can be loaded alongside these by passing Model a registry like this one
+hadcet_series = {
+    'meantemp': {'file': 'hadcet_mean.txt', 'url': 'https://www.metoffice.gov.uk/hadobs/hadcet/cetdl1772on.dat'},
+    'mintemp': {'file': 'hadcet_min.txt',
+                'url': 'https://www.metoffice.gov.uk/hadobs/hadcet/cetmindly1878on_urbadj4.dat'},
+    'maxtemp': {'file': 'hadcet_max.txt',
+                'url': 'https://www.metoffice.gov.uk/hadobs/hadcet/cetmaxdly1878on_urbadj4.dat'},
+}
 
-class Model:
-
-    def __init__(self, local_data=True):
-        self.local_data = local_data
-        self.df = self.get_hadcet_df()
-        self.ave_df = self.get_daily_ave_df()
+# which series of the registry are the daily (mean, low, high): the Part 1 averages and records, the Part 2 tables,
+#  the Part 4 timeline and the Part 5 heatmap are drawn from these, and every query defaults to them
+hadcet_main_series = ('meantemp', 'mintemp', 'maxtemp')
 
 
-    # this method uses all three static functions above to create the DataFrame we need
-    def get_hadcet_df(self):
+# a Model is an immutable snapshot of the data: once built nothing in it can change (its arrays are read-only, its
+#  attributes can't be reassigned, and it holds no DataFrames, only hands out new ones), so any number of threads can
+#  query it at once. to refresh the data, build a new Model and swap it in
+class Model:
 
-        # get 2D temp DataFrames
+    # previous can be the Model this one replaces (ex. before a fresh download), if the new data only adds days on
+    #  to the end of it, its ranks are updated instead of worked out again (see get_rank_matrix). a registry
+    #  without the HadCET names needs main_series to say which of its series are the (mean, low, high)
+    def __init__(self, local_data=True, hist_bin_edges=None, data_dir=local_data_dir, series=None, previous=None,
+                 main_series=None):
+        self.local_data = local_data
+        self.data_dir = data_dir
+        self.series = MappingProxyType(dict(hadcet_series if series is None else series))
+        self.series_names = tuple(self.series)
+        self.main_series = tuple(hadcet_main_series if main_series is None else main_series)
+        self.mean_series, self.low_series, self.high_series = self.main_series
+        missing = [name for name in self.main_series if name not in self.series]
+        if missing:
+            raise ValueError(f'main series {missing} are not in the registry {list(self.series_names)}, pass '
+                             f'main_series=(mean, low, high) naming three of its series')
+        # 1 degree bins wide enough for every daily mean, min, and max on record
+        self.hist_bin_edges = np.arange(-15., 36.) if hist_bin_edges is None else np.asarray(hist_bin_edges, float)
+        # each startup phase is timed, see python/metrics.py
+        dates, self.temps = self.get_series_array()
+        freeze(self.temps)
+        # the date axis is kept as plain read-only arrays (a DatetimeIndex's values can be written to): the dates, and
+        #  a row each of their years, months and days
+        self.dates = freeze(dates.values.copy())
+        self.date_parts = freeze(np.stack((dates.year.values, dates.month.values, dates.day.values)).astype(np.int64))
+        with stage('startup.year_matrix'):
+            self.year_matrix = self.get_year_matrix()
+        with stage('startup.ranks'):
+            self.rank_matrix = self.get_rank_matrix(previous)
+        with stage('startup.combine'):
+            self.columns = self.get_hadcet_columns()
+        with stage('startup.version'):
+            self.version = self.get_version()
+        with stage('startup.day_stats'):
+            self.day_stats = self.get_day_stats()
+        with stage('startup.daily_ave'):
+            self.ave_columns = freeze_columns(self.get_daily_ave_df())
+        with stage('startup.day_hist'):
+            self.day_hist = self.get_day_hist_counts()
+
+        self.frozen = True
+
+    # the data as a DataFrame: date, year, month, day, a column per series, and a '<series>_rank' column per series.
+    #  every caller gets a new copy, so changing it changes nothing for anyone else
+    @property
+    def df(self):
+        return to_frame(self.columns)
+
+    # the DataFrame from get_daily_ave_df(), also a new copy for every caller
+    @property
+    def ave_df(self):
+        return to_frame(self.ave_columns)
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError(f"Model is a read-only snapshot, can't set '{name}'")
+        super().__setattr__(name, value)
+
+    # a Model is pickled (ex. to send it to export workers started with 'spawn') with plain dicts in place of its
+    #  read-only mappings, and frozen again when it's loaded
+    def __getstate__(self):
+        return {name: thaw(value) for name, value in self.__dict__.items()}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            super().__setattr__(name, refreeze(value))
+        # each series' year matrix and column go back to being views of the one shared array, instead of their own
+        #  copies
+        year_matrix = dict(self.year_matrix)
+        year_matrix['temps'] = MappingProxyType({name: year_matrix['all_temps'][i]
+                                                 for i, name in enumerate(self.series_names)})
+        super().__setattr__('year_matrix', MappingProxyType(year_matrix))
+        super().__setattr__('columns', self.get_hadcet_columns())
+
+    # reads (or downloads) one series from the registry and flattens it into a 1D Series with a date index
+    def load_series(self, name):
         if self.local_data:
-            meantemps = read_local_hadcet_data('hadcet_mean.txt')
-            mintemps = read_local_hadcet_data('hadcet_min.txt')
-            maxtemps = read_local_hadcet_data('hadcet_max.txt')
-        else:
-            mean_temp_url = 'https://www.metoffice.gov.uk/hadobs/hadcet/cetdl1772on.dat'
-            min_temp_url = 'https://www.metoffice.gov.uk/hadobs/hadcet/cetmindly1878on_urbadj4.dat'
-            max_temp_url = 'https://www.metoffice.gov.uk/hadobs/hadcet/cetmaxdly1878on_urbadj4.dat'
-            meantemps = download_hadcet_data(mean_temp_url)
-            mintemps = download_hadcet_data(min_temp_url)
-            maxtemps = download_hadcet_data(max_temp_url)
-
-        # flatten the 2D DataFrames into 1D Series
-        mean_series = flatten_time(meantemps)
-        min_series = flatten_time(mintemps)
-        max_series = flatten_time(maxtemps)
-
-        # combine them into one DataFrame, organize columns
-        temps_df = pd.concat([mean_series, min_series, max_series], axis=1)
-        temps_df = temps_df.reset_index()
-        temps_df.columns = ['date', 'meantemp', 'mintemp', 'maxtemp']
-
-        # get some simpler time columns for indexing later (we wanted the datetime col for the pd.concat())
-        temps_df['year'] = temps_df['date'].apply(lambda d: int(str(d).split()[0].split('-')[0]))
-        temps_df['month'] = temps_df['date'].apply(lambda d: int(str(d).split()[0].split('-')[1]))
-        temps_df['day'] = temps_df['date'].apply(lambda d: int(str(d).split()[0].split('-')[2]))
-        temps_df = temps_df[['date', 'year', 'month', 'day', 'meantemp', 'mintemp', 'maxtemp']]
-
-        return temps_df
-
-    # (Part 1) this generates the DataFrame used to create the first plot in the dashboard
-    def get_daily_ave_df(self):
-
-        lows = []
-        highs = []
-        aves = []
-        fifths = []
-        ninetyfifths = []
-        month_list = []
-        day_list = []
-        cols = ['meantemp', 'mintemp', 'maxtemp']
-
-        for month in range(1, 13):
-            for day in range(1, 32):
-                daytemps = self.df[(self.df['month'] == month) & (self.df['day'] == day)][cols]
-                if len(daytemps > 0):
-                    lows.append(daytemps['mintemp'].min())
-                    highs.append(daytemps['maxtemp'].max())
-                    aves.append(daytemps['meantemp'].mean())
-                    fifths.append(np.percentile(daytemps['meantemp'].values, 5))
-                    ninetyfifths.append(np.percentile(daytemps['meantemp'].values, 95))
-                    month_list.append(month)
-                    day_list.append(day)
-
-        ave_df = pd.DataFrame({'month': month_list, 'day': day_list, 'lows': lows, 'highs': highs, 'aves': aves,
-                               'fifths': fifths, 'ninetyfifths': ninetyfifths, })
+            return flatten_time(read_local_hadcet_data(self.series[name]['file'], self.data_dir))
+        return flatten_time(download_hadcet_data(self.series[name]['url']))
+
+    # loads every series (in parallel, mostly to overlap the downloads) and lines them up on one shared daily date
+    #  axis. the temps come back as one contiguous 2D array, a row per series (in registry order), NaN wherever a
+    #  series has no value (ex. min and max temps before 1878)
+    def get_series_array(self):
+        with stage('startup.load'):
+            with ThreadPoolExecutor(max_workers=min(8, len(self.series_names))) as pool:
+                all_series = list(pool.map(self.load_series, self.series_names))
+
+        with stage('startup.align'):
+            first = min(series.index[0] for series in all_series)
+            dates = pd.date_range(first, max(series.index[-1] for series in all_series))
+            temps = np.full((len(all_series), len(dates)), np.nan)
+            for row, series in zip(temps, all_series):
+                # counted in whole days, a nanosecond timedelta overflows on records longer than 292 years
+                days = series.index.values.astype('datetime64[D]') - first.to_datetime64().astype('datetime64[D]')
+                row[days.astype(np.int64)] = series.values
+
+        return dates, temps
+
+    # this method puts the shared date axis, the 2D temps array, and each temp's calendar day rank (a '<series>_rank'
+    #  column per series) together into the read-only columns the df property is made from. the temps columns are
+    #  views of self.temps
+    def get_hadcet_columns(self):
+        ranks = freeze(self.rank_matrix[:, self.year_matrix['row'], self.year_matrix['col']])
+
+        # get some simpler time columns for indexing later
+        columns = {'date': self.dates, 'year': self.date_parts[0], 'month': self.date_parts[1],
+                   'day': self.date_parts[2]}
+        columns.update(zip(self.series_names, self.temps))
+        columns.update(zip([name + '_rank' for name in self.series_names], ranks))
+
+        return MappingProxyType(columns)
+
+    # a short fingerprint of the data (last date + hash of every temp), cached results are keyed on it so nothing
+    #  computed from an older download gets mixed in after the data is refreshed
+    def get_version(self):
+        digest = hashlib.sha1(','.join(self.series_names + self.main_series).encode() + self.temps.tobytes())
+        return f"{pd.Timestamp(self.dates[-1]):%Y%m%d}-{digest.hexdigest()[:12]}"
+
+    # the temps rearranged into a dense (n_years, 366) array per series: a row per year and a column per calendar day
+    #  (see get_calendar_day), so Feb 29 is always column 59 and Mar 1 is always column 60. the Feb 29 of non-leap years
+    #  and days outside the record are NaN ('exists' tells them apart from days a series just has no value for). a year
+    #  is then a row slice and a calendar day a column slice. all the series share one contiguous read-only array
+    def get_year_matrix(self):
+        years = np.arange(self.date_parts[0][0], self.date_parts[0][-1] + 1)
+        rows = self.date_parts[0] - years[0]
+        cols = get_calendar_day(self.date_parts[1], self.date_parts[2])
+
+        all_temps = np.full((len(self.series_names), len(years), 366), np.nan)
+        all_temps[:, rows, cols] = self.temps
+        exists = np.zeros((len(years), 366), bool)
+        exists[rows, cols] = True
+        leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+        for arr in [years, all_temps, exists, leap]:
+            freeze(arr)
+
+        temps = {name: all_temps[i] for i, name in enumerate(self.series_names)}
+
+        # 'row' and 'col' are where each date of self.temps sits in the matrix
+        return MappingProxyType({'years': years, 'leap': leap, 'exists': exists, 'all_temps': all_temps,
+                                 'temps': MappingProxyType(temps), 'row': freeze(rows), 'col': freeze(cols)})
+
+    # how unusual every temp is for its calendar day: the fraction of that day's temps (same series, every year)
+    #  below it, counting ties and the temp itself as half, so the coldest of n is 0.5/n and the warmest 1 - 0.5/n.
+    #  laid out like year_matrix['all_temps']. all the (series, calendar day) groups are ranked in one pass, or, when
+    #  the previous Model's data is the start of this one's and only a few years of days were appended, updated from
+    #  the previous ranks (see update_rank_matrix)
+    def get_rank_matrix(self, previous=None):
+        all_temps = self.year_matrix['all_temps']
+        n_series, n_years, _ = all_temps.shape
+
+        if previous is not None and previous.series_names == self.series_names and \
+                previous.dates[0] == self.dates[0] and len(previous.dates) <= len(self.dates) and \
+                np.array_equal(previous.temps, self.temps[:, :len(previous.dates)], equal_nan=True):
+            appended = np.zeros((n_years, 366), bool)
+            appended[self.year_matrix['row'][len(previous.dates):], self.year_matrix['col'][len(previous.dates):]] = True
+            appended_rows = np.flatnonzero(appended.any(axis=1))
+            if len(appended_rows) <= 5:
+                return self.update_rank_matrix(previous, appended, appended_rows)
+
+        # each (series, calendar day) column is ranked down the years on its own
+        columns = all_temps.transpose(1, 0, 2).reshape(n_years, -1)
+        ranks = pd.DataFrame(columns).rank().values
+        with np.errstate(invalid='ignore'):
+            pct = (ranks - .5) / (~np.isnan(columns)).sum(axis=0)
+
+        return freeze(pct.reshape(n_years, n_series, 366).transpose(1, 0, 2).copy())
+
+    # the ranks after days were appended to the previous Model's data (appended marks their places in the year matrix,
+    #  appended_rows the years they fall in). nothing is sorted again: a temp's rank is the number of its day's temps
+    #  below it plus half the number equal to it (itself included, so it's 1-based), so each old temp's rank just goes
+    #  up by the appended temps below it (and half of those equal to it), and each appended temp is counted against
+    #  its whole day. one comparison of every temp per appended year, which is why only a few years are done this way
+    def update_rank_matrix(self, previous, appended, appended_rows):
+        all_temps = self.year_matrix['all_temps']
+        n_prev_years = previous.rank_matrix.shape[1]
+        old_temps = np.where(appended, np.nan, all_temps)
+        count = (~np.isnan(all_temps)).sum(axis=1)
+
+        # back from the previous fractions to ranks, which are always whole or half numbers
+        ranks = np.full(all_temps.shape, np.nan)
+        ranks[:, :n_prev_years] = previous.rank_matrix * (~np.isnan(previous.rank_matrix)).sum(axis=1)[:, None] + .5
+        ranks = np.round(ranks * 2) / 2
+        for row in appended_rows:
+            new_temps = np.where(appended[row], all_temps[:, row], np.nan)[:, None, :]
+            ranks += (new_temps < old_temps) + (new_temps == old_temps) / 2
+        for row in appended_rows:
+            new_temps = all_temps[:, row][:, None, :]
+            new_ranks = (all_temps < new_temps).sum(axis=1) + ((all_temps == new_temps).sum(axis=1) + 1) / 2
+            ranks[:, row] = np.where(appended[row], new_ranks, ranks[:, row])
+        with np.errstate(invalid='ignore'):
+            rank_matrix = np.where(np.isnan(all_temps), np.nan, (ranks - .5) / count[:, None, :])
+
+        return freeze(rank_matrix)
+
+    # one year of a series as a row of 366 calendar days (all NaN for a year outside the record)
+    def get_year_row(self, year, series=None):
+        series = self.mean_series if series is None else series
+        i = year - self.year_matrix['years'][0]
+        if not 0 <= i < len(self.year_matrix['years']):
+            return np.full(366, np.nan)
+        return self.year_matrix['temps'][series][i]
+
+    # one calendar day of a series as a column, a value per year (NaN where the year has no such day)
+    def get_day_column(self, month, day, series=None):
+        series = self.mean_series if series is None else series
+        return self.year_matrix['temps'][series][:, get_calendar_day(month, day)]
+
+    # per calendar day stats of every series at once, reduced down the year axis of the year matrix: each stat maps
+    #  every series to a read-only array of its 366 days (jan 1 to dec 31)
+    def get_day_stats(self):
+        all_temps = self.year_matrix['all_temps']
+        count = (~np.isnan(all_temps)).sum(axis=1)
+
+        # NaNs sort to the end of each column, so the percentiles (linear interpolation, like np.percentile) only ever
+        #  look at the first count values
+        sorted_temps = np.sort(all_temps, axis=1)
+        with np.errstate(invalid='ignore'):
+            mean = np.nansum(all_temps, axis=1) / count
+            percentiles = []
+            for q in [.05, .95]:
+                pos = (count - 1) * q
+                lo = np.take_along_axis(sorted_temps, np.floor(pos).astype(int)[:, None, :].clip(0), axis=1)[:, 0]
+                hi = np.take_along_axis(sorted_temps, np.ceil(pos).astype(int)[:, None, :].clip(0), axis=1)[:, 0]
+                percentiles.append(lo + (hi - lo) * (pos - np.floor(pos)))
+
+        stats = {'min': np.fmin.reduce(all_temps, axis=1), 'max': np.fmax.reduce(all_temps, axis=1), 'mean': mean,
+                 'fifth': percentiles[0], 'ninetyfifth': percentiles[1], 'count': count}
+        day_stats = {}
+        for name, stat in stats.items():
+            freeze(stat)
+            day_stats[name] = MappingProxyType({series: stat[i] for i, series in enumerate(self.series_names)})
+
+        return MappingProxyType(day_stats)
+
+    # (Part 1) this generates the DataFrame used to create the first plot in the dashboard: record lows from the 'low'
+    #  series, record highs from the 'high' series, and the average and percentiles of the 'mean' series
+    def get_daily_ave_df(self, mean=None, low=None, high=None):
+        mean = self.mean_series if mean is None else mean
+        low = self.low_series if low is None else low
+        high = self.high_series if high is None else high
+        ave_df = pd.DataFrame({'month': np.repeat(np.arange(1, 13), month_lengths),
+                               'day': np.concatenate([np.arange(1, n + 1) for n in month_lengths]),
+                               'lows': self.day_stats['min'][low],
+                               'highs': self.day_stats['max'][high],
+                               'aves': self.day_stats['mean'][mean],
+                               'fifths': self.day_stats['fifth'][mean],
+                               'ninetyfifths': self.day_stats['ninetyfifth'][mean]})
 
         return ave_df
 
-    # (Part 2) this generates the DataFrame for a table in the dashboard
-    def get_day_prev_5yr(self, month, day):
-
-        # TODO -need to make a custom fix for Feb. 29, only shows 2016 and 2020
-
-        # find the most recent year that a temp has been recorded for this day and month
-        last_whole_year = self.df[(self.df['day'] == day) & (self.df['month'] == month)]['year'].max()
-
-        # select year, min, and max associated with this day and month and within the most recent 5 years
-        # finally, reverse the list so that the most recent temp is on top
-        normal_range = range(last_whole_year - 4, last_whole_year + 1)
-        feb29_range = range(last_whole_year - 16, last_whole_year + 1)
-        our_range = normal_range if not ((month == 2) and (day == 29)) else feb29_range
-        #print(month, day, list(our_range))
-        cols = ['year', 'mintemp', 'maxtemp']
-        table_df = self.df[(self.df['year'].isin(list(our_range))) &
-                           (self.df['day'] == day) & (self.df['month'] == month)][cols].iloc[::-1, :]
-
-        # force them into strings because dash keeps giving me the ol' 3.4000000000000001
-        table_df['mintemp'] = table_df['mintemp'].round(1).astype(str)
-        table_df['maxtemp'] = table_df['maxtemp'].round(1).astype(str)
-
-        # rename columns to how we'll want them to be in the dashboard
-        table_df.columns = ['Year', 'Daily Low', 'Daily High']
+    # (Part 2) this counts, for every calendar day, how many temps of each series fell in each temperature bin, so the
+    #  date histogram never has to re-filter df (rows of the count arrays are the 366 days, jan 1 to dec 31). all the
+    #  series are binned together in one pass
+    def get_day_hist_counts(self):
+        n_series = len(self.series_names)
+        n_bins = len(self.hist_bin_edges) - 1
+        calendar_day = self.year_matrix['col']
+
+        recorded = ~np.isnan(self.temps)
+        # temps outside the bin edges still count toward n, they just don't land in a bar
+        bins = np.searchsorted(self.hist_bin_edges, self.temps, side='right') - 1
+        in_range = recorded & (bins >= 0) & (bins < n_bins)
+        series_day = np.arange(n_series)[:, None] * 366 + calendar_day[None, :]
+        all_counts = np.bincount(series_day[in_range] * n_bins + bins[in_range],
+                                 minlength=n_series * 366 * n_bins).reshape(n_series, 366, n_bins)
+        all_n = np.bincount(series_day[recorded], minlength=n_series * 366).reshape(n_series, 366)
+        for arr in [all_counts, all_n, self.hist_bin_edges]:
+            freeze(arr)
+
+        counts = {name: all_counts[i] for i, name in enumerate(self.series_names)}
+        n_obs = {name: all_n[i] for i, name in enumerate(self.series_names)}
+
+        return MappingProxyType({'edges': self.hist_bin_edges, 'counts': MappingProxyType(counts),
+                                 'n': MappingProxyType(n_obs)})
+
+    # (Part 2) this generates the DataFrame for a table in the dashboard, from the 'low' and 'high' series
+    def get_day_prev_5yr(self, month, day, low=None, high=None):
+        low = self.low_series if low is None else low
+        high = self.high_series if high is None else high
+
+        # the 5 most recent years this day and month are in the record (for Feb. 29, the 5 most recent leap years),
+        #  reversed so that the most recent temp is on top
+        calendar_day = get_calendar_day(month, day)
+        rows = np.flatnonzero(self.year_matrix['exists'][:, calendar_day])[-5:][::-1]
+
+        # build a new DataFrame (named how we'll want the columns in the dashboard).
+        #  temps are forced into strings because dash keeps giving me the ol' 3.4000000000000001
+        table_df = pd.DataFrame({'Year': self.year_matrix['years'][rows],
+                                 'Daily Low': pd.Series(self.get_day_column(month, day, low)[rows]).round(1)
+                                                .astype(str).values,
+                                 'Daily High': pd.Series(self.get_day_column(month, day, high)[rows]).round(1)
+                                                 .astype(str).values})
 
         return table_df
 
-    # (Part 2) this generates two DataFrames for two tables in the dashboard
-    def get_day_records(self, month, day):
-        maxdf = self.df[(self.df['month'] == month) & (self.df['day'] == day)] \
-                    .sort_values('maxtemp', ascending=False)[['year', 'maxtemp']][:5]
-        mindf = self.df[(self.df['month'] == month) & (self.df['day'] == day)] \
-                    .sort_values('mintemp')[['year', 'mintemp']][:5]
+    # (Part 2) this generates two DataFrames for two tables in the dashboard, record lows of the 'low' series and
+    #  record highs of the 'high' series
+    def get_day_records(self, month, day, low=None, high=None):
+        low = self.low_series if low is None else low
+        high = self.high_series if high is None else high
+        exists = self.year_matrix['exists'][:, get_calendar_day(month, day)]
+        years = self.year_matrix['years'][exists]
+        maxrows = pd.Series(self.get_day_column(month, day, high)[exists], index=years) \
+                      .sort_values(ascending=False)[:5]
+        minrows = pd.Series(self.get_day_column(month, day, low)[exists], index=years) \
+                      .sort_values()[:5]
 
         # dashboard tables are bad about miniscule floating point error, so we pass in a rounded string instead
-        mindf['mintemp'] = mindf['mintemp'].round(1).astype(str)
-        maxdf['maxtemp'] = maxdf['maxtemp'].round(1).astype(str)
-
-        maxdf.columns = ['Year', 'Temp (C)']
-        mindf.columns = ['Year', 'Temp (C)']
+        mindf = pd.DataFrame({'Year': minrows.index.values,
+                              'Temp (C)': minrows.round(1).astype(str).values})
+        maxdf = pd.DataFrame({'Year': maxrows.index.values,
+                              'Temp (C)': maxrows.round(1).astype(str).values})
 
         return mindf, maxdf
 
     # (Part 2) this generates the historical probability of seeing at least a given temp on a given day
-    def get_perc_geq(self, month, day, temp):
-        temps = self.df[(self.df['month'] == month) & (self.df['day'] == day)]['meantemp'].values
-        count_geq = sum([t >= temp for t in temps])
+    def get_perc_geq(self, month, day, temp, series=None):
+        series = self.mean_series if series is None else series
+        temps = self.get_day_column(month, day, series)
+        temps = temps[~np.isnan(temps)]
+        count_geq = np.count_nonzero(temps >= temp)
         return str(round(count_geq * 100 / len(temps), 1))
 
-    def get_year_comp_table(self, years):
+    # the n days that were most unusual for their calendar day (furthest from the middle of that day's temps, see
+    #  get_rank_matrix), in one year (a row of the rank matrix) or over the whole record, most unusual first. every
+    #  day's record ties at the top, so ties go to whichever temp is furthest from its day's average
+    def get_unusual_days(self, year=None, n=10, series=None):
+        series = self.mean_series if series is None else series
+        years = self.year_matrix['years']
+        ranks = self.rank_matrix[self.series_names.index(series)]
+        temps = self.year_matrix['temps'][series]
+        if year is not None:
+            # just the year's row (none for a year outside the record)
+            i = year - years[0]
+            year_rows = slice(i, i + 1) if 0 <= i < len(years) else slice(0, 0)
+            years, ranks, temps = years[year_rows], ranks[year_rows], temps[year_rows]
+
+        # the (year, calendar day) of every ranked temp, in date order
+        rows, cols = np.nonzero(~np.isnan(ranks))
+        extremeness = np.abs(ranks[rows, cols] - .5)
+        anomaly = np.abs(temps[rows, cols] - self.day_stats['mean'][series][cols])
+        order = np.lexsort((-anomaly, -extremeness))[:n]
+        rows, cols = rows[order], cols[order]
+
+        offsets = np.concatenate(([0], np.cumsum(month_lengths)[:-1]))
+        month = np.searchsorted(offsets, cols, side='right')
+        day = cols - offsets[month - 1] + 1
+
+        # rounded strings for the dashboard tables, like the other tables
+        dates = [f'{y}-{m:02d}-{d:02d}' for y, m, d in zip(years[rows], month, day)]
+        unusual_df = pd.DataFrame({'Date': np.array(dates, dtype=object),
+                                   'Temp (C)': pd.Series(temps[rows, cols]).round(1).astype(str).values,
+                                   'Percentile': pd.Series(ranks[rows, cols] * 100).round(1).astype(str).values})
+
+        return unusual_df
+
+    # (Part 3) averages of the 'mean' series, lows of the 'low' series, and highs of the 'high' series for each year
+    def get_year_comp_table(self, years, mean=None, low=None, high=None):
+        mean = self.mean_series if mean is None else mean
+        low = self.low_series if low is None else low
+        high = self.high_series if high is None else high
 
         # don't want the table to be too long, only accept 5 selected years (dash has no way to limit the number of
         #  selections in a multi-dropdown)
         years = years[:5]
         year_comp_table = pd.DataFrame(columns=['Year', 'Average', 'Low', 'High'])
         year_comp_table.loc[0] = ['All Time',
-                                  str(round(self.ave_df['aves'].mean(), 2)),
-                                  str(round(self.df['mintemp'].min(), 1)),
-                                  str(round(self.df['maxtemp'].max(), 1))]
+                                  str(round(np.nanmean(self.day_stats['mean'][mean]), 2)),
+                                  str(round(np.nanmin(self.day_stats['min'][low]), 1)),
+                                  str(round(np.nanmax(self.day_stats['max'][high]), 1))]
         if len(years) == 0:
             return year_comp_table
         for i, year in enumerate(years):
             year_comp_table.loc[i+1] = [str(year),
-                                        str(round(self.df[self.df['year'] == year]['meantemp'].mean(), 2)),
-                                        str(round(self.df[self.df['year'] == year]['mintemp'].min(), 1)),
-                                        str(round(self.df[self.df['year'] == year]['maxtemp'].max(), 1))]
+                                        str(round(pd.Series(self.get_year_row(year, mean)).mean(), 2)),
+                                        str(round(np.fmin.reduce(self.get_year_row(year, low)), 1)),
+                                        str(round(np.fmax.reduce(self.get_year_row(year, high)), 1))]
 
         return year_comp_table
 
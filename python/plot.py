@@ -1,44 +1,90 @@
+import base64
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
-from python.data import get_rolling_ave
+from types import MappingProxyType
+from python.data import get_rolling_ave, minmax_decimate, get_calendar_day, freeze, freeze_columns, to_frame, thaw, \
+    refreeze, month_lengths
+from python.model import hadcet_main_series
 
+# like Model, a Plot is read-only once built, so threads can share it
 class Plot:
 
-    def __init__(self, df, ave_df):
+    # main_series is the Model's (mean, low, high), the series the timeline and heatmap show and the queries default to
+    def __init__(self, df, ave_df, day_hist, year_matrix, main_series=None):
 
-        self.df = df
-        self.ave_df = ave_df
-        self.long_months = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
-                            'October', 'November', 'December']
+        self.main_series = tuple(hadcet_main_series if main_series is None else main_series)
+        self.mean_series, self.low_series, self.high_series = self.main_series
+        missing = [name for name in self.main_series if name not in year_matrix['temps']]
+        if missing:
+            raise ValueError(f"main series {missing} are not in the data {list(year_matrix['temps'])}, pass the "
+                             "Model's main_series")
+        # kept as read-only columns, like Model does, the df and ave_df properties hand out copies
+        self.columns = freeze_columns(df)
+        self.ave_columns = freeze_columns(ave_df)
+        # precomputed per-date histogram counts from Model.get_day_hist_counts()
+        self.day_hist = day_hist
+        # the (n_years, 366) calendar-aligned temps of each series from Model.get_year_matrix()
+        self.year_matrix = year_matrix
+        self.long_months = ('January', 'February', 'March', 'April', 'May', 'June', 'July', 'August', 'September',
+                            'October', 'November', 'December')
         # self.colors is not used, but the order matches the order of the hex colors in light and dark colors
-        self.colors = ['green', 'orange', 'blue', 'pink', 'brown']
-        self.light_colors = ['#AADDA9', '#FAC586', '#C2C1FF', '#F9BAF1', '#D9B089']
-        self.dark_colors = ['#23A320', '#DD7903', '#2923EC', '#E80DCE', '#6F3600']
+        self.colors = ('green', 'orange', 'blue', 'pink', 'brown')
+        self.light_colors = ('#AADDA9', '#FAC586', '#C2C1FF', '#F9BAF1', '#D9B089')
+        self.dark_colors = ('#23A320', '#DD7903', '#2923EC', '#E80DCE', '#6F3600')
+        # the full daily record is downsampled to roughly two points per pixel of the timeline's width
+        self.timeline_width = 1000
+        self.timeline_pyramid = self.get_timeline_pyramid()
+        # the heatmap sends at most this many cells, coarser bins are used until the view fits. the whole record fits in
+        #  weekly bins (250 years x 53 weeks), monthly bins are only needed for records of more than about 377 years
+        self.heatmap_max_cells = 20000
+        self.heatmap_levels = self.get_heatmap_levels()
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError(f"Plot is read-only, can't set '{name}'")
+        super().__setattr__(name, value)
+
+    @property
+    def df(self):
+        return to_frame(self.columns)
+
+    @property
+    def ave_df(self):
+        return to_frame(self.ave_columns)
+
+    # pickled like Model, with plain dicts in place of the read-only mappings
+    def __getstate__(self):
+        return {name: thaw(value) for name, value in self.__dict__.items()}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            super().__setattr__(name, refreeze(value))
 
     # (Part 1) This gets the five traces that stay the same in the top plot
     def get_alltime_traces(self):
         xspan = pd.date_range(start='1/1/1772', end='12/31/1772')
 
-        high = go.Scatter(x=xspan, y=self.ave_df['highs'], name='record highs', mode='lines',
+        high = go.Scatter(x=xspan, y=self.ave_columns['highs'], name='record highs', mode='lines',
                           line=dict(color='red', width=1),
                           hovertemplate=
                           "Day:" + "%{x|%m/%d}".rjust(25) +
                           "<br>Record High:" + "%{y} C".rjust(9) +
                           "<br><extra></extra>"
                           )
-        nfth = go.Scatter(x=xspan, y=self.ave_df['ninetyfifths'], name='ninety-fifth percentile', mode='lines',
+        nfth = go.Scatter(x=xspan, y=self.ave_columns['ninetyfifths'], name='ninety-fifth percentile', mode='lines',
                           line=dict(color='firebrick', width=1), hoverinfo='skip')
-        ave = go.Scatter(x=xspan, y=self.ave_df['aves'], name='all-time daily average',
+        ave = go.Scatter(x=xspan, y=self.ave_columns['aves'], name='all-time daily average',
                          line=dict(color='black', width=2),
                          hovertemplate=
                          "Day:" + "%{x|%m/%d}".rjust(40) +
                          "<br>Alltime Day Average:" + "%{y} C".rjust(10) +
                          "<br><extra></extra>"
                          )
-        fth = go.Scatter(x=xspan, y=self.ave_df['fifths'], name='fifth percentile', mode='lines',
+        fth = go.Scatter(x=xspan, y=self.ave_columns['fifths'], name='fifth percentile', mode='lines',
                          line=dict(color='royalblue', width=1), hoverinfo='skip')
-        low = go.Scatter(x=xspan, y=self.ave_df['lows'], name='record lows', mode='lines',
+        low = go.Scatter(x=xspan, y=self.ave_columns['lows'], name='record lows', mode='lines',
                          line=dict(color='blue', width=1),
                          hovertemplate=
                          "Day:" + "%{x|%m/%d}".rjust(25) +
@@ -47,13 +93,27 @@ class Plot:
                          )
         return [high, nfth, ave, fth, low]
 
-    # (Parts 1 & 3) This gets the trace for a single year (with smoothing)
-    def get_year_trace(self, year, window_size, color_num):
-        yvals = get_rolling_ave(self.df[self.df['year'] == year]['meantemp'].values, window_size, fillna=True)
+    # (Parts 1 & 3) This gets the trace for a single year (with smoothing) of any series in df, one row of the year
+    #  matrix, so every day lines up with the same calendar day of the all-time traces
+    def get_year_trace(self, year, window_size, color_num, series=None):
+        series = self.mean_series if series is None else series
+        i = year - self.year_matrix['years'][0]
+        if 0 <= i < len(self.year_matrix['years']):
+            leap = self.year_matrix['leap'][i]
+            days = self.year_matrix['temps'][series][i]
+        else:
+            # a year outside the record gets an empty line
+            leap, days = True, np.full(366, np.nan)
+        # smooth over the days the year actually has, then leave the gap at Feb 29 in non-leap years
+        days = days if leap else np.delete(days, 59)
+        yvals = get_rolling_ave(days, window_size, fillna=True)
         yvals = np.concatenate((yvals[(window_size - 1) // 2:], yvals[:(window_size - 1) // 2]))
+        yvals = yvals if leap else np.insert(yvals, 59, np.nan)
         year_trace = go.Scatter(x=pd.date_range(start='1/1/1772', end='12/31/1772'), y=yvals,
                                 name=f'{year} temps',
                                 line=dict(color=self.dark_colors[color_num], width=2),
+                                # draws straight over the missing Feb 29
+                                connectgaps=True,
                                 hovertemplate=
                                 "Date:" + ("%{x|%m/%d}/" + f"{year}").rjust(21) +
                                 "<br>Mean Temp:" + "%{y} C".rjust(9) +
@@ -62,7 +122,7 @@ class Plot:
         return year_trace
 
     # (Part 1) This creates the plot of the current year with the 5 traces generated in the above method
-    def get_lineplot(self, year, window_size):
+    def get_lineplot(self, year, window_size, series=None):
         lineplot = go.Figure()
 
         # the five lines always on the graph
@@ -71,7 +131,7 @@ class Plot:
             lineplot.add_trace(t)
 
         # the selected year's line (0 -> color is always green)
-        lineplot.add_trace(self.get_year_trace(year, window_size, 0))
+        lineplot.add_trace(self.get_year_trace(year, window_size, 0, series))
 
         lineplot.update_xaxes(dtick='M1', tickformat='%b',
                               showline=True, linewidth=2, linecolor='black', gridcolor='grey')
@@ -83,15 +143,23 @@ class Plot:
 
         return lineplot
 
+    # (Part 1) Instead of a whole new figure, this sends only the selected year's line; the five all-time traces and
+    #  the layout stay in the browser. x is left out since it's always the 1772 span the all-time traces already have
+    def get_lineplot_patch(self, year, window_size, series=None):
+        year_trace = self.get_year_trace(year, window_size, 0, series).to_plotly_json()
+        year_trace.pop('x')
+        return {'year': year, 'window_size': window_size, 'trace': year_trace}
+
     # (not used) Generates histogram comparing selected year's temps to alltime temps
     def get_histogram(self, which, year):
 
         # 'which' can take on values of 'mintemp', 'meantemp', or 'maxtemp'
 
         histogram = go.Figure()
-        histogram.add_trace(go.Histogram(x=self.df[self.df['year'] == year][which], histnorm='probability density',
+        df = self.df
+        histogram.add_trace(go.Histogram(x=df[df['year'] == year][which], histnorm='probability density',
                                          nbinsx=18, name=f'{year} temps'))
-        histogram.add_trace(go.Histogram(x=self.df[which], histnorm='probability density',
+        histogram.add_trace(go.Histogram(x=df[which], histnorm='probability density',
                                          nbinsx=18, name=f'Alltime daily {which}'))
         histogram.update_xaxes(range=[-5, 30], showgrid=False)
         histogram.update_yaxes(range=[0, .12], showgrid=False, showticklabels=False)
@@ -102,19 +170,38 @@ class Plot:
 
         return histogram
 
+    # (Part 2) Gets the bar heights (as probability density), name, and title of the histogram for a given date from
+    #  the precomputed counts, this is all that changes in the histogram when a new date is picked
+    def get_day_hist_patch(self, month, day, which=None):
+
+        # 'which' can take on values of 'mintemp', 'meantemp', or 'maxtemp' (any series, the mean series by default)
+        which = self.mean_series if which is None else which
+
+        calendar_day = get_calendar_day(month, day)
+        counts = self.day_hist['counts'][which][calendar_day]
+        n = int(self.day_hist['n'][which][calendar_day])
+        density = counts / (max(n, 1) * np.diff(self.day_hist['edges']))
+
+        return {'y': density, 'name': f'{month}/{day} temps',
+                'title': f'Histogram of n={n} observations from {self.long_months[month - 1]} {day}'}
+
     # (Part 2) Creates the histogram of all temps on a given date (with a vert line at a selected temp)
-    def get_day_hist(self, month, day, temp):
-        temps = self.df[(self.df['month'] == month) & (self.df['day'] == day)]['meantemp']
+    def get_day_hist(self, month, day, temp, which=None):
+        edges = self.day_hist['edges']
+        patch = self.get_day_hist_patch(month, day, which)
+
         day_hist = go.Figure()
-        day_hist.add_trace(go.Histogram(x=temps, histnorm='probability density', name=f'{month}/{day} temps',
-                                        hovertemplate='Temp Range: ' + '%{x}<br>'.rjust(9) +
-                                                      'Proportion: ' + '%{y}'.rjust(14)))
+        day_hist.add_trace(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=patch['y'], width=np.diff(edges),
+                                  name=patch['name'],
+                                  customdata=[f'{lo:g} to {hi:g}' for lo, hi in zip(edges[:-1], edges[1:])],
+                                  hovertemplate='Temp Range: ' + '%{customdata}<br>'.rjust(9) +
+                                                'Proportion: ' + '%{y}'.rjust(14)))
         day_hist.add_vline(x=temp)
         day_hist.update_layout(xaxis=dict(range=[-12, 28], tickmode='linear', dtick=1, title='Degrees Celsius',
                                           title_standoff=0),
                                yaxis=dict(range=[0, .25], showticklabels=False, showgrid=False),
-                               title_text=f'Histogram of n={len(temps)} observations '
-                                          f'from {self.long_months[month - 1]} {day}',
+                               bargap=0,
+                               title_text=patch['title'],
                                title_x=.5,
                                title_yanchor='top',
                                margin_t=35,
@@ -125,12 +212,12 @@ class Plot:
         return day_hist
 
     # (Part 3) Creates graph comparing temps of selected years, with smoothing
-    def get_year_comparison_graph(self, years, window_size, start_month=1, end_month=10):
+    def get_year_comparison_graph(self, years, window_size, start_month=1, end_month=10, series=None):
         xspan = pd.date_range(start='1/1/1772', end='12/31/1772')
 
         lineplot = go.Figure()
 
-        ave = go.Scatter(x=xspan, y=self.ave_df['aves'], name='all-time average',
+        ave = go.Scatter(x=xspan, y=self.ave_columns['aves'], name='all-time average',
                          line=dict(color='black', width=2),
                          hovertemplate=
                          "Day:" + "%{x|%m/%d}".rjust(40) +
@@ -140,7 +227,7 @@ class Plot:
         lineplot.add_trace(ave)
 
         for color_num, year in enumerate(years):
-            lineplot.add_trace(self.get_year_trace(year, window_size, color_num))
+            lineplot.add_trace(self.get_year_trace(year, window_size, color_num, series))
 
         lineplot.update_xaxes(#dtick='M1',# tickformat='%b',
                               showline=True, linewidth=2, linecolor='black', gridcolor='grey',
@@ -165,4 +252,163 @@ class Plot:
                                                  self.long_months[end_month-1][:3]])
                                )
 
-        return lineplot
\ No newline at end of file
+        return lineplot
+
+    # (Part 3) Works out how to get from the years already drawn to the newly selected years. Years still selected are
+    #  kept in the browser (just recolored, since colors follow selection order), only new years get a trace sent
+    def get_year_comparison_patch(self, years, window_size, drawn_years=(), drawn_window_size=None, series=None):
+
+        # if the smoothing changed, none of the drawn traces can be reused
+        if drawn_window_size != window_size:
+            drawn_years = []
+        drawn_years = list(drawn_years)
+
+        traces = []
+        for color_num, year in enumerate(years):
+            if year in drawn_years:
+                traces.append({'keep': drawn_years.index(year), 'color': self.dark_colors[color_num]})
+            else:
+                year_trace = self.get_year_trace(year, window_size, color_num, series).to_plotly_json()
+                year_trace.pop('x')
+                traces.append({'trace': year_trace})
+
+        return {'years': years, 'window_size': window_size, 'traces': traces}
+
+    # (Part 4) Precomputes each series at several resolutions (raw, then min/max decimated into buckets of 4, 8, 16...
+    #  days) until the whole record fits on screen, so a zoom only needs to slice out the right level
+    def get_timeline_pyramid(self):
+        max_points = 2 * self.timeline_width
+        pyramid = {}
+        for col in [self.high_series, self.mean_series, self.low_series]:
+            # min and max temps weren't recorded until 1878, so drop the empty days before building the levels
+            x, y = self.columns['date'], self.columns[col]
+            x, y = x[~np.isnan(y)], y[~np.isnan(y)]
+            levels = [(x, y)]
+            bucket_size = 4
+            while len(levels[-1][1]) > max_points:
+                levels.append(minmax_decimate(x, y, bucket_size))
+                bucket_size *= 2
+            pyramid[col] = tuple((freeze(x), freeze(y)) for x, y in levels)
+
+        return MappingProxyType(pyramid)
+
+    # (Part 4) Zooming out can move the view far past the record, and past the years 1677-2262 that pandas timestamps
+    #  cover (one click of "zoom out" from the full record already does), so the date is parsed by numpy, to the day,
+    #  and clipped to the dates in x
+    def clip_date(self, date, x):
+        day = np.datetime64(date).astype('datetime64[D]')
+        return np.clip(day, x[0].astype('datetime64[D]'), x[-1].astype('datetime64[D]')).astype(x.dtype)
+
+    # (Part 4) Gets the x and y values of the three timeline traces between start and end (None for the ends of the
+    #  record), taken from the finest pyramid level that still fits the screen
+    def get_timeline_patch(self, start=None, end=None):
+        max_points = 2 * self.timeline_width
+        traces = []
+        for col, levels in self.timeline_pyramid.items():
+            for x, y in levels:
+                i0 = 0 if start is None else np.searchsorted(x, self.clip_date(start, x))
+                i1 = len(x) if end is None else np.searchsorted(x, self.clip_date(end, x), side='right')
+                if i1 - i0 <= max_points:
+                    break
+            # one extra point on each side so the lines run all the way to the edges of the view
+            i0, i1 = max(i0 - 1, 0), min(i1 + 1, len(x))
+            # plain dates are much shorter on the wire than full timestamps
+            traces.append({'x': np.datetime_as_string(x[i0:i1], unit='D'), 'y': y[i0:i1]})
+
+        return {'start': start, 'end': end, 'traces': traces}
+
+    # (Part 4) Creates the WebGL plot of every daily temperature on record, starting fully zoomed out
+    def get_timeline(self):
+        timeline = go.Figure()
+
+        names = {self.high_series: 'daily high', self.mean_series: 'daily mean', self.low_series: 'daily low'}
+        colors = {self.high_series: 'firebrick', self.mean_series: 'black', self.low_series: 'royalblue'}
+        patch = self.get_timeline_patch()
+        for col, trace in zip(self.timeline_pyramid, patch['traces']):
+            timeline.add_trace(go.Scattergl(x=trace['x'], y=trace['y'], name=names[col], mode='lines',
+                                            line=dict(color=colors[col], width=1),
+                                            hovertemplate=
+                                            "Date:" + "%{x|%m/%d/%Y}".rjust(21) +
+                                            f"<br>{names[col].title()}:" + "%{y} C".rjust(9) +
+                                            "<br><extra></extra>"
+                                            ))
+
+        timeline.update_xaxes(showline=True, linewidth=2, linecolor='black', gridcolor='grey')
+        timeline.update_yaxes(showgrid=False, zeroline=False,
+                              showline=True, linewidth=2, linecolor='black', gridcolor='black')
+        timeline.update_layout(autosize=False, margin=dict(t=0, b=10), width=self.timeline_width, height=320,
+                               yaxis_title='Degrees Celsius',
+                               plot_bgcolor='rgb(230, 230, 255)',
+                               # keeps the zoom in place when the clientside callback swaps in new points
+                               uirevision='timeline')
+
+        return timeline
+
+    # (Part 5) Precomputes the anomaly (daily mean minus the all-time average for that calendar day, ave_df['aves']) of
+    #  every year and day at three resolutions: daily, weekly (7 day bins from Jan 1), and monthly. each level is the
+    #  bin edges (in days since Jan 1 on the 366-day calendar) and a (n_years, n_bins) array of bin averages
+    def get_heatmap_levels(self):
+        anomalies = self.year_matrix['temps'][self.mean_series] - self.ave_columns['aves']
+        recorded = ~np.isnan(anomalies)
+        filled = np.where(recorded, anomalies, 0)
+
+        bin_starts = {'daily': np.arange(366), 'weekly': np.arange(0, 366, 7),
+                      'monthly': np.concatenate(([0], np.cumsum(month_lengths)[:-1]))}
+        levels = {}
+        for level, starts in bin_starts.items():
+            # days with no temp (Feb 29 in non-leap years, the rest of the current year) are left out of the averages
+            with np.errstate(invalid='ignore'):
+                z = np.add.reduceat(filled, starts, axis=1) / np.add.reduceat(recorded, starts, axis=1)
+            levels[level] = (freeze(np.append(starts, 366)), freeze(z))
+
+        return MappingProxyType(levels)
+
+    # (Part 5) Gets the cells between days x0 and x1 and years y0 and y1 (None for the edges of the record), from the
+    #  finest level that keeps them under heatmap_max_cells: the level's name, the x bin edges, the years, and the
+    #  anomalies
+    def get_heatmap_cells(self, x0=None, x1=None, y0=None, y1=None):
+        years = self.year_matrix['years']
+        # a year's row runs from year - .5 to year + .5
+        r0 = 0 if y0 is None else np.searchsorted(years, y0 - .5, side='right')
+        r1 = len(years) if y1 is None else np.searchsorted(years, y1 + .5)
+        for level, (edges, z) in self.heatmap_levels.items():
+            c0 = 0 if x0 is None else max(np.searchsorted(edges, x0, side='right') - 1, 0)
+            c1 = z.shape[1] if x1 is None else min(np.searchsorted(edges, x1), z.shape[1])
+            if (r1 - r0) * (c1 - c0) <= self.heatmap_max_cells:
+                break
+
+        return level, edges[c0:c1 + 1], years[r0:r1], z[r0:r1, c0:c1]
+
+    # (Part 5) The heatmap cells for a view, with the anomalies packed as little-endian int16 tenths of a degree
+    #  (-32768 for no data) in base64, about a third of the size of the same numbers in json. the clientside callback
+    #  unpacks them
+    def get_heatmap_patch(self, x0=None, x1=None, y0=None, y1=None):
+        level, x, y, z = self.get_heatmap_cells(x0, x1, y0, y1)
+        packed = np.where(np.isnan(z), -32768, np.round(z * 10)).astype('<i2')
+
+        return {'range': [x0, x1, y0, y1], 'level': level, 'x': x, 'y': y, 'shape': packed.shape, 'scale': .1,
+                'z': base64.b64encode(packed.tobytes()).decode('ascii')}
+
+    # (Part 5) Creates the heatmap of every year's daily anomalies, starting fully zoomed out (weekly bins)
+    def get_heatmap(self):
+        level, x, y, z = self.get_heatmap_cells()
+
+        heatmap = go.Figure()
+        heatmap.add_trace(go.Heatmap(x=x, y=y, z=np.round(z, 1), colorscale='RdBu_r', zmid=0, zmin=-6, zmax=6,
+                                     colorbar=dict(title='C', thickness=15),
+                                     hovertemplate=
+                                     "Year:" + "%{y}".rjust(12) +
+                                     "<br>Anomaly:" + "%{z:.1f} C".rjust(12) +
+                                     "<extra></extra>"
+                                     ))
+
+        month_starts = self.heatmap_levels['monthly'][0][:-1]
+        heatmap.update_xaxes(tickvals=month_starts, ticktext=[month[:3] for month in self.long_months],
+                             showline=True, linewidth=2, linecolor='black')
+        heatmap.update_yaxes(autorange='reversed', showline=True, linewidth=2, linecolor='black')
+        heatmap.update_layout(autosize=False, margin=dict(t=0, b=10), width=1000, height=600,
+                              yaxis_title='Year',
+                              # keeps the zoom in place when the clientside callback swaps in new cells
+                              uirevision='heatmap')
+
+        return heatmap
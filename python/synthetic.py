@@ -0,0 +1,89 @@
+import os
+import numpy as np
+
+from python.data import get_rolling_ave, month_lengths
+
+# the real daily mean record runs from 1772 to 2021, so scale=1 gives about the same amount of data
+real_n_years = 250
+# pandas timestamps end in April 2262, so a record starting in 1772 can't be any longer than this
+max_n_years = 2262 - 1772
+
+
+# how much data a benchmark scale (1 = the real record) means: more years, up to max_n_years, then more series (as
+#  weather 'stations', see write_synthetic_stations) for the rest, so there are about scale times as many daily temps
+def get_scaled_shape(scale):
+    n_years = min(int(round(scale * real_n_years)), max_n_years)
+    n_series = max(3, int(round(3 * scale * real_n_years / n_years)))
+
+    return n_years, n_series
+
+
+# makes up a daily temperature series (in tenths of a degree, like the HadCET files): a seasonal cycle, a slight
+#  warming trend, and smoothed noise so neighbouring days look alike. returns a (n_years, 31, 12) array laid out like
+#  the file rows (day, month), -999 where the date doesn't exist
+def get_synthetic_temps(n_years, first_year=1772, offset=0., seed=0):
+    rng = np.random.default_rng(seed)
+    years = np.arange(first_year, first_year + n_years)
+    leap = (years % 4 == 0) & ((years % 100 != 0) | (years % 400 == 0))
+
+    # which (year, month, day) slots are real dates, in date order (month-major)
+    lengths = np.tile(month_lengths, (n_years, 1))
+    lengths[~leap, 1] = 28
+    exists = np.arange(1, 32)[None, None, :] <= lengths[:, :, None]
+
+    day_of_year = (np.cumsum(exists.reshape(n_years, -1), axis=1) - 1)[exists.reshape(n_years, -1)]
+    year_idx = np.repeat(np.arange(n_years), exists.reshape(n_years, -1).sum(axis=1))
+
+    noise = get_rolling_ave(rng.normal(0, 55, len(day_of_year) + 2), 3)
+    temps = 95 + offset - 65 * np.cos(2 * np.pi * (day_of_year - 15) / 366) + 0.025 * year_idx + noise
+
+    grid = np.full((n_years, 12, 31), -999)
+    grid[exists] = np.round(temps).astype(int)
+
+    return years, grid.transpose(0, 2, 1)
+
+
+# writes one HadCET-format .txt file: each row is 'year day jan feb ... dec'
+def write_hadcet_file(path, years, grid):
+    n_years = len(years)
+    rows = np.column_stack((np.repeat(years, 31), np.tile(np.arange(1, 32), n_years), grid.reshape(n_years * 31, 12)))
+    np.savetxt(path, rows, fmt='%5d', delimiter='')
+
+
+# writes hadcet_mean.txt, hadcet_min.txt, and hadcet_max.txt into out_dir with scale times the real record's length
+#  (extra years carry on past 2021), so everything that reads the real files can be pointed at bigger ones
+def write_synthetic_hadcet(out_dir, scale=1, first_year=1772, seed=0):
+    n_years = int(round(scale * real_n_years))
+    if first_year + n_years > 2262:
+        raise ValueError(f'{n_years} years from {first_year} run into 2262, where pandas timestamps end '
+                         f'(use more series instead, see get_scaled_shape)')
+    os.makedirs(out_dir, exist_ok=True)
+
+    years, mean_grid = get_synthetic_temps(n_years, first_year, seed=seed)
+    # min and max sit a few degrees either side of the mean
+    rng = np.random.default_rng(seed + 1)
+    missing = mean_grid == -999
+    min_grid = np.where(missing, -999, mean_grid - np.abs(rng.normal(40, 10, mean_grid.shape)).round().astype(int))
+    max_grid = np.where(missing, -999, mean_grid + np.abs(rng.normal(40, 10, mean_grid.shape)).round().astype(int))
+
+    for name, grid in [('hadcet_mean.txt', mean_grid), ('hadcet_min.txt', min_grid), ('hadcet_max.txt', max_grid)]:
+        write_hadcet_file(os.path.join(out_dir, name), years, grid)
+
+    return out_dir
+
+
+# writes n_series made-up daily series into out_dir: the three HadCET files (see above) plus n_series - 3 extra
+#  'stations', each offset a little from the others. returns the registry to pass to Model(series=...) to load them all
+def write_synthetic_stations(out_dir, n_series, scale=1, first_year=1772, seed=0):
+    write_synthetic_hadcet(out_dir, scale, first_year, seed)
+    n_years = int(round(scale * real_n_years))
+    rng = np.random.default_rng(seed)
+
+    series = {name: {'file': f'hadcet_{name[:-4]}.txt', 'url': None} for name in ['meantemp', 'mintemp', 'maxtemp']}
+    for i in range(n_series - 3):
+        years, grid = get_synthetic_temps(n_years, first_year, offset=rng.normal(0, 20), seed=seed + 2 + i)
+        name = f'station{i:03d}'
+        write_hadcet_file(os.path.join(out_dir, name + '.txt'), years, grid)
+        series[name] = {'file': name + '.txt', 'url': None}
+
+    return series
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import pickle
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from plotly.utils import PlotlyJSONEncoder
+
+from python.data import month_lengths
+from python.model import Model
+from python.plot import Plot
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# n random Model/Plot queries, the same mix the callbacks make: (name, function of (model, plot))
+def get_queries(model, n, seed=0):
+    rng = random.Random(seed)
+    first_year, last_year = int(model.year_matrix['years'][0]), int(model.year_matrix['years'][-1])
+
+    def random_date():
+        month = rng.randint(1, 12)
+        return month, rng.randint(1, month_lengths[month - 1])
+
+    def random_years():
+        return rng.sample(range(first_year, last_year + 1), rng.randint(1, 5))
+
+    makers = [
+        lambda: ('lineplot_patch', lambda m, p, y=rng.randint(first_year, last_year), w=rng.randrange(1, 36, 2):
+                 p.get_lineplot_patch(y, w)),
+        lambda: ('day_hist_patch', lambda m, p, d=random_date(): p.get_day_hist_patch(*d)),
+        lambda: ('day_prev_5yr', lambda m, p, d=random_date(): m.get_day_prev_5yr(*d).to_dict('records')),
+        lambda: ('day_records', lambda m, p, d=random_date(): [t.to_dict('records') for t in m.get_day_records(*d)]),
+        lambda: ('perc_geq', lambda m, p, d=random_date(), t=rng.randint(-5, 25): m.get_perc_geq(*d, t)),
+        lambda: ('year_comp_table', lambda m, p, ys=random_years(): m.get_year_comp_table(ys).to_dict('records')),
+        lambda: ('year_comparison_patch', lambda m, p, ys=random_years(): p.get_year_comparison_patch(ys, 29)),
+        lambda: ('unusual_days', lambda m, p, y=rng.randint(first_year, last_year):
+                 m.get_unusual_days(y, 5).to_dict('records')),
+        lambda: ('timeline_patch', lambda m, p, y=rng.randint(first_year, last_year - 1):
+                 p.get_timeline_patch(f'{y}-01-01', f'{y + 1}-06-01')),
+        lambda: ('heatmap_patch', lambda m, p, x=rng.uniform(0, 300), y=rng.uniform(first_year, last_year - 20):
+                 p.get_heatmap_patch(x, x + 60, y, y + 20)),
+    ]
+
+    return [rng.choice(makers)() for _ in range(n)]
+
+
+def run_query(query, model, plot):
+    name, func = query
+    return name, json.dumps(func(model, plot), cls=PlotlyJSONEncoder, sort_keys=True)
+
+
+# none of these may change the shared data. writes into it (attributes, arrays, mappings) must raise, writes to a
+#  DataFrame that Model or Plot handed out may go through, but only change that caller's copy. (name, write, must raise)
+def get_writes(model, plot):
+    def set_item(arr):
+        arr[0] = 0
+
+    def drop_rows(df):
+        df.drop(index=df.index[:10], inplace=True)
+
+    def set_loc(df, col):
+        df.loc[df.index[0], col] = 99
+
+    def set_column(df, col):
+        df[col] = 0
+
+    return [
+        ('Model attribute', lambda: setattr(model, 'df', None), True),
+        ('Plot attribute', lambda: setattr(plot, 'df', None), True),
+        ('Model.columns temps', lambda: set_item(model.columns['meantemp']), True),
+        ('Model.columns ranks', lambda: set_item(model.columns['meantemp_rank']), True),
+        ('Model.columns mapping', lambda: model.columns.__setitem__('meantemp', None), True),
+        ('Model.ave_columns', lambda: set_item(model.ave_columns['aves']), True),
+        ('Model.day_stats', lambda: set_item(model.day_stats['mean']['meantemp']), True),
+        ('Model.day_hist counts', lambda: set_item(model.day_hist['counts']['meantemp'][0]), True),
+        ('Model.day_hist mapping', lambda: model.day_hist['counts'].__setitem__('meantemp', None), True),
+        ('Model.year_matrix', lambda: set_item(model.year_matrix['temps']['meantemp'][0]), True),
+        ('Model.rank_matrix', lambda: set_item(model.rank_matrix[0, 0]), True),
+        ('Model.dates', lambda: set_item(model.dates), True),
+        ('Plot.columns', lambda: set_item(plot.columns['meantemp']), True),
+        ('Plot.timeline_pyramid', lambda: set_item(plot.timeline_pyramid['meantemp'][0][1]), True),
+        ('Plot.heatmap_levels', lambda: set_item(plot.heatmap_levels['daily'][1][0]), True),
+        ('Model.df values', lambda: set_item(model.df['meantemp'].values), False),
+        ('Model.df column assignment', lambda: set_column(model.df, 'meantemp'), False),
+        ('Model.df drop', lambda: drop_rows(model.df), False),
+        ('Model.df loc', lambda: set_loc(model.df, 'meantemp_rank'), False),
+        ('Model.ave_df column assignment', lambda: set_column(model.ave_df, 'aves'), False),
+        ('Model.ave_df drop', lambda: drop_rows(model.ave_df), False),
+        ('Model.ave_df loc', lambda: set_loc(model.ave_df, 'lows'), False),
+        ('Plot.df column assignment', lambda: set_column(plot.df, 'meantemp'), False),
+        ('Plot.df drop', lambda: drop_rows(plot.df), False),
+        ('Plot.ave_df loc', lambda: set_loc(plot.ave_df, 'aves'), False),
+    ]
+
+
+# runs the same queries serially and from many threads sharing one Model and Plot (and again on a pickled copy, the
+#  way spawned export workers get them), and checks the results match and that writes to the shared data raise
+def check(data_dir, n_queries=600, threads=16):
+    model = Model(local_data=True, data_dir=data_dir)
+    plot = Plot(model.df, model.ave_df, model.day_hist, model.year_matrix, model.main_series)
+    queries = get_queries(model, n_queries)
+    failures = []
+
+    serial = [run_query(query, model, plot) for query in queries]
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        threaded = list(pool.map(lambda query: run_query(query, model, plot), queries))
+    failures += [f'threaded {name} differs from serial' for (name, a), (_, b) in zip(serial, threaded) if a != b]
+
+    unpickled_model, unpickled_plot = pickle.loads(pickle.dumps((model, plot)))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        unpickled = list(pool.map(lambda query: run_query(query, unpickled_model, unpickled_plot), queries))
+    failures += [f'unpickled {name} differs from serial' for (name, a), (_, b) in zip(serial, unpickled) if a != b]
+
+    frames = [model.df, model.ave_df, plot.df, plot.ave_df]
+    for m, p, label in [(model, plot, ''), (unpickled_model, unpickled_plot, 'unpickled ')]:
+        for name, write, must_raise in get_writes(m, p):
+            try:
+                write()
+                if must_raise:
+                    failures.append(f'writing to {label}{name} did not raise')
+            except (AttributeError, ValueError, TypeError):
+                pass
+
+    # nothing the writes tried can have changed what the queries, or the next caller of df or ave_df, see
+    after = [run_query(query, model, plot) for query in queries]
+    failures += [f'{name} changed after the writes' for (name, a), (_, b) in zip(serial, after) if a != b]
+    frame_names = ['Model.df', 'Model.ave_df', 'Plot.df', 'Plot.ave_df']
+    failures += [f'{name} changed after the writes' for name, before, now
+                 in zip(frame_names, frames, [model.df, model.ave_df, plot.df, plot.ave_df]) if not before.equals(now)]
+
+    print(f'{n_queries} queries from {threads} threads, {len(get_writes(model, plot))} writes: '
+          + ('ok' if not failures else f'{len(failures)} failures'))
+    for failure in failures[:20]:
+        print('    ' + failure)
+
+    return not failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check Model and Plot give the same answers when shared by threads')
+    parser.add_argument('--data-dir', default=os.path.join(repo_dir, 'data'))
+    parser.add_argument('--queries', type=int, default=600)
+    parser.add_argument('--threads', type=int, default=16)
+    args = parser.parse_args()
+
+    sys.exit(0 if check(args.data_dir, args.queries, args.threads) else 1)